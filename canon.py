@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 class Canon:
     """Keeps canonical instances of hashable objects to save space when there
        will be many equal copies made for whatever reason.
@@ -11,21 +13,64 @@ class Canon:
        This filtering process maps each thing onto its canonical equivalent
        (an object instance that is equal to it) from a cache. If and when the
        thing in question is not already present in the cache, the thing itself
-       is added to the cache and then the thing is mapped onto itself."""
-    
-    def __init__(self, things=None):
-        self.storage = {}
+       is added to the cache and then the thing is mapped onto itself.
+
+       By default the cache grows without limit. Given a `capacity`, it keeps
+       at most that many things, evicting the least recently used one to make
+       room for a new one. An evicted thing is still a perfectly good
+       instance; it just stops being the one all equal things are mapped
+       onto.
+
+       `hits`, `misses`, and `evictions` count what `single` has done since
+       the cache was made or last cleared."""
+
+    def __init__(self, things=None, capacity=None):
+        """:param things: things to start the cache with
+           :param capacity: the most things to keep, or None for no limit"""
+        if capacity is not None and capacity < 1:
+            raise ValueError('capacity must be >= 1 or None')
+        self.capacity = capacity
+        self.storage = {} if capacity is None else OrderedDict()
+        self.hits = self.misses = self.evictions = 0
         if things:
             self.multi(things)
-    
+
+    def __len__(self):
+        return len(self.storage)
+
+    def __contains__(self, thing):
+        return thing in self.storage
+
     def single(self, thing):
         """:returns: the canonical equivalent instance of `thing`"""
+        storage = self.storage
         try:
-            return self.storage[thing]
+            canonical = storage[thing]
         except KeyError:
-            self.storage[thing] = thing
+            self.misses += 1
+            storage[thing] = thing
+            if self.capacity is not None and len(storage) > self.capacity:
+                storage.popitem(last=False)
+                self.evictions += 1
             return thing
-    
+        self.hits += 1
+        if self.capacity is not None:
+            storage.move_to_end(thing)
+        return canonical
+
     def multi(self, things):
         """:returns: a collection of canonical instances of elements of `things`"""
         return type(things)(self.single(thing) for thing in things)
+
+    def clear(self):
+        """Forget all canonical instances and reset the counters."""
+        self.storage.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """:returns: a dict of the size, capacity, and counters of the cache"""
+        return {'size'     : len(self.storage),
+                'capacity' : self.capacity,
+                'hits'     : self.hits,
+                'misses'   : self.misses,
+                'evictions': self.evictions}
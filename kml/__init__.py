@@ -1,5 +1,9 @@
-"""A helper to handle KML files as bs4.BeautifulSoup XML documents."""
+"""A helper to handle KML files as bs4.BeautifulSoup XML documents.
 
+   Most helpers also accept lxml.etree documents from the faster 'lxml'
+   backend of `open` and `parse`; see `kml.etree`."""
+
+import bisect
 import itertools
 
 from shapefile import signed_area
@@ -9,25 +13,31 @@ import rounding
 import spindex as sx
 import stokes as _STOKES
 
-from neighboring import fuzzy, seamless
+from neighboring import fuzzy, seamless, seamless_chunked, snapped
 from point_in_polygon import Polygon
 from stokes import _sides
 
+from . import coords
+from . import etree as _etree
 from . import kmz
 from . import layers
 
-from .io import _OPEN, open, parse, save, format, formatted
+from .io import (_OPEN, open, parse, save, write, format, formatted,
+                 iter_placemarks)
 
 def get_data(pm, name=None):
     """Find a `<Data>` or `<SimpleData>` element in `pm` having the specified
        `name` attribute and return the element's value. Raise ValueError if no
        such data element is found.
        
-       :param pm: a KML element (bs4.element.Tag), preferably a Placemark
+       :param pm: a KML element (bs4.element.Tag or lxml.etree element),
+       preferably a Placemark
        :param name: value of the "name' attribute of a data tag in `pm`, or
        None to return all data as a dict
        :returns: the Placemark's data with the specified `name` or a dict of
        all the Placemark's data"""
+    if _etree.is_element(pm):
+        return _etree.get_data(pm, name)
     if name is None:
         names = [d['name']
                  for d in pm(lambda tag :
@@ -63,12 +73,16 @@ def add(tag, name, soup=None):
        is much nicer than
        add(add(add(add(pm,'Polygon'),'outerBoundaryIs'),'LinearRing'),'coordinates')
 
-       :param tag: a bs4.element.Tag or a bs4.BeautifulSoup
+       :param tag: a bs4.element.Tag or a bs4.BeautifulSoup, or an lxml.etree
+       element
        :param name: a string name for a Tag or a list of strings
-       :param soup: (optional) a BeautifulSoup used to create new Tags
+       :param soup: (optional) a BeautifulSoup used to create new Tags. Not
+       used for lxml.etree elements.
        :returns: the added Tag or the final added Tag
        """
 
+    if _etree.is_element(tag):
+        return _etree.add(tag, name)
     if soup is None:
         if tag.name == '[document]':
             soup = tag
@@ -115,14 +129,17 @@ def new_soup(name=None, src=_SOUP_STOCK):
 def coords_from_tag(coordinates_tag, first_n_coords=2):
     """Return a list of points from `coordinates_tag.string`.
 
-       :param coordinates_tag: a KML <coordinates> element (bs4.element.Tag)
+       If the tag's document has been cached with `kml.coords.cache`, the
+       points are copied from that cache instead of being parsed again. Either
+       way the list is new.
+
+       :param coordinates_tag: a KML <coordinates> element (bs4.element.Tag
+       or lxml.etree element)
        :param first_n_coords: only convert this many dimensions per point
        :returns: a list of tuples of floats
        """
     
-    return [tuple([float(dim)
-                   for dim in chunk.split(',')][:first_n_coords])
-            for chunk in coordinates_tag.string.strip().split()]
+    return coords.points(coordinates_tag, first_n_coords)
 
 def coords_to_text(boundary):
     """Return a text representation of the boundary or single point.
@@ -160,14 +177,14 @@ def _new_tuples(dims, decimals, coordinates_tag):
        """
     
     prev_yield = None
-    for chunk in coordinates_tag.string.strip().split():
+    for chunk in _etree.string(coordinates_tag).strip().split():
         new_chunk = ','.join(rounding.float(dim, decimals)
                              for dim in chunk.split(',')[:dims])
         if new_chunk != prev_yield:
             prev_yield = new_chunk
             yield new_chunk
 
-def dock(soup, decimals=6, dims=2):
+def dock(soup, decimals=6, dims=2, batch=False):
     """Limit the decimal part of floats in `<coordinates>` tags.
 
        The function mainly exists to help limit the size of files to be used
@@ -176,15 +193,69 @@ def dock(soup, decimals=6, dims=2):
        Unite adjacent duplicate points.
        
        :param soup: a KML document (bs4.BeautifulSoup) or element
-       (bs4.element.Tag)
+       (bs4.element.Tag), or an lxml.etree document or element
        :param decimals: the max number of digits allowed after the integer
        part of a number
+       :param batch: if True, round all the coordinates of `soup` at once
+       with NumPy (see `rounding.floats`) instead of one value at a time. The
+       results are the same.
        :returns: None
        """
-    for coordinates_tag in soup("coordinates"):
-        coordinates_tag.string = ' '.join(_new_tuples(dims,
-                                                      decimals,
-                                                      coordinates_tag))
+    coordinates_tags = _etree.find_all(soup, "coordinates")
+    if batch:
+        coordinates_tags = _dock_batch(coordinates_tags, decimals, dims)
+    for coordinates_tag in coordinates_tags:
+        _etree.set_string(coordinates_tag,
+                          ' '.join(_new_tuples(dims,
+                                               decimals,
+                                               coordinates_tag)))
+
+def _dock_batch(coordinates_tags, decimals, dims):
+    """Dock the coordinates of all of `coordinates_tags` together.
+
+       All the values of all the tags are rounded in one call to
+       `rounding.floats`, adjacent duplicate points are found with one array
+       comparison, and each tag's text is rebuilt from the rounded strings.
+
+       :returns: a list of the tags that were skipped because their points
+       don't all have the same number of values, to be docked one at a time
+       """
+    import numpy as np
+    
+    skipped = []
+    tags, tables = [], []
+    for tag in coordinates_tags:
+        text = _etree.string(tag).strip()
+        chunks = text.split()
+        width = chunks[0].count(',') + 1 if chunks else 0
+        if width < dims or any(chunk.count(',') != width - 1
+                               for chunk in chunks):
+            skipped.append(tag)
+            continue
+        tags.append(tag)
+        tables.append(np.array(text.replace(',', ' ').split()
+                               ).reshape(len(chunks), width)[:, :dims])
+    if not tags:
+        return skipped
+    
+    docked = rounding.floats(np.concatenate(tables), decimals)
+    points = docked[:, 0]
+    for dim in range(1, dims):
+        points = np.char.add(np.char.add(points, ','), docked[:, dim])
+    
+    #a point is kept if it differs from the one before it or starts a ring
+    offsets = np.cumsum([0] + [len(table) for table in tables])
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = points[1:] != points[:-1]
+    keep[offsets[:-1]] = True
+    kept = np.cumsum(keep)
+    ends = kept[offsets[1:] - 1]
+    starts = np.concatenate([[0], ends[:-1]])
+    
+    points = points[keep].tolist()
+    for tag, start, end in zip(tags, starts, ends):
+        _etree.set_string(tag, ' '.join(points[start:end]))
+    return skipped
 
 def stokes(layer):
     """Convenience method to check for open seams before coloring.
@@ -195,25 +266,31 @@ def stokes(layer):
        """
 
     if isinstance(layer, list):
-        obis = itertools.chain.from_iterable(pm('outerBoundaryIs')
-                                             for pm in layer)
-        ibis = itertools.chain.from_iterable(pm('innerBoundaryIs')
-                                             for pm in layer)
+        obis = itertools.chain.from_iterable(
+                _etree.find_all(pm, 'outerBoundaryIs') for pm in layer)
+        ibis = itertools.chain.from_iterable(
+                _etree.find_all(pm, 'innerBoundaryIs') for pm in layer)
     else:
-        obis = layer('outerBoundaryIs')
-        ibis = layer('innerBoundaryIs')
+        obis = _etree.find_all(layer, 'outerBoundaryIs')
+        ibis = _etree.find_all(layer, 'innerBoundaryIs')
                         
     
-    outers = [coords_from_tag(coord_tag)
+    outers = [coords.array(coord_tag)
               for coord_tag in itertools.chain.from_iterable(
-                      obi('coordinates') for obi in obis)]
-    outers = [x if signed_area(x) >= 0 else list(reversed(x)) for x in outers]
-    inners = [coords_from_tag(coord_tag)
+                      _etree.find_all(obi, 'coordinates') for obi in obis)]
+    outers = [x if _signed_area(x) >= 0 else x[::-1] for x in outers]
+    inners = [coords.array(coord_tag)
               for coord_tag in itertools.chain.from_iterable(
-                      ibi('coordinates') for ibi in ibis)]
-    inners = [x if signed_area(x) < 0 else list(reversed(x)) for x in inners]
+                      _etree.find_all(ibi, 'coordinates') for ibi in ibis)]
+    inners = [x if _signed_area(x) < 0 else x[::-1] for x in inners]
     return _STOKES.stokes(itertools.chain(outers, inners))
 
+def _signed_area(points):
+    """Return the signed area of the ring `points`, an (N, 2) array; it's
+       positive if the ring runs counterclockwise (like `signed_area`)."""
+    x, y = points[:, 0], points[:, 1]
+    return float((x[:-1] * y[1:] - x[1:] * y[:-1]).sum()) / 2
+
 def stokes_visualize(stoked_bounds):
     """Visualize complex stokes output as a kml document (bs4.BeautifulSoup).
 
@@ -245,10 +322,10 @@ def stokes_audit(layer, bounds):
        :param bounds: a list of lists of points (tuple/list of 2 or 3 floats)
        """
     
-    pms = layer('Placemark')
+    pms = _etree.find_all(layer, 'Placemark')
     pm_sides = [set(itertools.chain.from_iterable(
             _sides(coords_from_tag(coord_tag))
-            for coord_tag in pm('coordinates')))
+            for coord_tag in _etree.find_all(pm, 'coordinates')))
                 for pm in pms]
     
     bound_sides = [set(_sides(bound)) for bound in bounds]
@@ -258,7 +335,8 @@ def stokes_audit(layer, bounds):
              if pm_sides[j] & bound_sides[i]]
             for i in range(len(bounds))]
 
-def adjacency(layer, sorter=None, scale=None, probe_factor=1000):
+def adjacency(layer, sorter=None, scale=None, probe_factor=1000, workers=1,
+              memory=None, tolerance=None, min_length=0.0):
     """Return an adajcency graph for the Placemarks of the layer.
 
        :param layer: a KML document or Folder
@@ -268,18 +346,133 @@ def adjacency(layer, sorter=None, scale=None, probe_factor=1000):
        :param probe_factor: divide the length of a side by twice this to get
        the distance from the side's midpoint to either probe point for that
        side
+       :param workers: build the Placemarks' polygons, and assess fuzzy
+       adjacency, with this many processes (see `load_polygons` and
+       `neighboring.fuzzy`), or None for one per CPU
+       :param memory: if given, match the Placemarks' sides in pieces using
+       about this many bytes (see `neighboring.seamless_chunked`)
+       :param tolerance: if given, also link Placemarks whose boundaries come
+       within this distance of each other (see `neighboring.snapped`)
+       :param min_length: with `tolerance`, the least length of shared
+       boundary for such a link
        :returns: a set of ints (vertices) and frozensets of two ints (edges)
        """
     
-    pms = layer("Placemark")
+    pms = _etree.find_all(layer, "Placemark")
     if sorter is not None:
         pms.sort(key=sorter)
-    pm_polygons = [Polygon.from_kml(pms[i], info=i) for i in range(len(pms))]
-    graph = seamless(pm_polygons)
+    pm_polygons = load_polygons(pms, workers=workers)
+    if memory is None:
+        graph = seamless(pm_polygons)
+    else:
+        graph = seamless_chunked(pm_polygons, memory=memory)
     if scale is not None:
-        graph |= fuzzy(pm_polygons, probe_factor=probe_factor, scale=scale)
+        graph |= fuzzy(pm_polygons, probe_factor=probe_factor, scale=scale,
+                       workers=workers)
+    if tolerance is not None:
+        graph |= snapped(pm_polygons, tolerance, min_length=min_length)
     return graph
 
+def load_polygons(placemarks, workers=1, infos=None, edge_okay=False):
+    """Build a `CompactPolygon` for each of the `placemarks`, in parallel.
+
+       The coordinate text of each Placemark's boundaries is gathered here,
+       and then chunks of Placemarks are sent to a pool of processes, each of
+       which parses the text, orients the boundaries, and assigns inner
+       boundaries to outer ones just as `Polygon.from_kml` does. Each chunk
+       comes back as a few flat NumPy arrays rather than as lists of tuples,
+       and the returned polygons are views into those arrays.
+
+       :param placemarks: a list of Placemark elements (bs4 or lxml.etree)
+       :param workers: the number of processes to use, or None for one per
+       CPU. With 1 (the default), everything is done in this process.
+       :param infos: the `info` of each polygon; by default, its index in
+       `placemarks`
+       :param edge_okay: passed to each polygon
+       :returns: a list of `point_in_polygon.CompactPolygon`, in the order of
+       `placemarks`
+       """
+    import os
+    from point_in_polygon import CompactPolygon
+    
+    if infos is None:
+        infos = range(len(placemarks))
+    texts = [_polygon_texts(pm) for pm in placemarks]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    if workers <= 1 or len(texts) < 2:
+        results = [_polygon_arrays(texts)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        size = -(-len(texts) // (4 * workers))
+        chunks = [texts[i:i+size] for i in range(0, len(texts), size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_polygon_arrays, chunks))
+    
+    polygons = []
+    infos = iter(infos)
+    for coords, offsets, holes, ring_counts, hole_counts in results:
+        ring, hole = 0, 0
+        for ring_count, hole_count in zip(ring_counts.tolist(),
+                                          hole_counts.tolist()):
+            start, stop = offsets[ring], offsets[ring + ring_count]
+            polygons.append(CompactPolygon.from_arrays(
+                    coords[start:stop],
+                    offsets[ring:ring + ring_count + 1] - start,
+                    holes[hole:hole + hole_count],
+                    info=next(infos),
+                    edge_okay=edge_okay))
+            ring += ring_count
+            hole += hole_count
+    return polygons
+
+def _polygon_texts(pm):
+    """Return the coordinate texts of the outer and inner boundaries of the
+       Polygon or MultiGeometry in Placemark `pm`, as `Polygon.from_kml`
+       finds them."""
+    geo = _etree.find(pm, 'MultiGeometry')
+    if geo is None:
+        geo = _etree.find(pm, 'Polygon')
+    if geo is None:
+        raise ValueError('Placemark has no Polygon or MultiGeometry')
+    outers = [str(_etree.string(_etree.find(obi, 'coordinates')))
+              for obi in _etree.find_all(geo, 'outerBoundaryIs')]
+    inners = [str(_etree.string(tag))
+              for ibi in _etree.find_all(geo, 'innerBoundaryIs')
+              for tag in _etree.find_all(ibi, 'coordinates')]
+    return outers, inners
+
+def _polygon_arrays(texts):
+    """Build the polygons from a chunk of `_polygon_texts` and pack them
+       all into flat arrays.
+
+       :returns: the vertices of all the polygons' boundaries, the offsets of
+       the boundaries in those, the outer of each inner boundary (per
+       polygon), and the numbers of boundaries and of inner boundaries of
+       each polygon
+       """
+    import numpy as np
+    from point_in_polygon import CompactPolygon
+    
+    packed = [CompactPolygon([coords.parse(text).tolist() for text in outers],
+                             [coords.parse(text).tolist() for text in inners])
+              for outers, inners in texts]
+    offsets = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for polygon in packed:
+        offsets.append(polygon.offsets[1:] + base)
+        base += len(polygon.coords)
+    return (np.concatenate([polygon.coords for polygon in packed]
+                           or [np.zeros((0, 2))]),
+            np.concatenate(offsets),
+            np.concatenate([polygon.holes for polygon in packed]
+                           or [np.zeros(0, dtype=np.int64)]),
+            np.array([len(polygon.offsets) - 1 for polygon in packed],
+                     dtype=np.int64),
+            np.array([len(polygon.holes) for polygon in packed],
+                     dtype=np.int64))
+
 _GREEN_ORANGE = {1 : '7fa8d7b6',
                  2 : '7f065fb4',
                  3 : '7f4fa86a',
@@ -396,7 +589,7 @@ def apply_color(layer, coloring, colorize=_GREEN_ORANGE, icons=_BLURPGRELLOW):
     
     
 
-def spatial_index(soup, scale=16):
+def spatial_index(soup, scale=16, keys=False, classify=False):
     """Return a dict from rectangles on Earth to Placemarks that intersect them.
        
        If you have a large number of points and a large number of polygons and
@@ -416,18 +609,32 @@ def spatial_index(soup, scale=16):
        :param scale: the width/height of Earth in degrees (as in a Mercator
        projection) is divided by two raised to `scale` to determine the width/
        height of the cells by which this function indexes space
+
+       :param keys: if True, the cells in the index are ints from
+       `spindex.cell_key` instead of `spindex._Cell` objects, which takes far
+       less memory for big indexes
+
+       :param classify: if True, return a `spindex.ClassifiedIndex`, which
+       also records which Placemarks' boundaries cross each cell. A point in
+       a cell that a Placemark's boundary doesn't cross is certainly inside
+       that Placemark, with no point-in-polygon test needed.
        """
     
-    pms = soup('Placemark')
-    index = {}
+    pms = _etree.find_all(soup, 'Placemark')
+    index = sx.ClassifiedIndex() if classify else {}
     for i in range(len(pms)):
         pm = pms[i]
         
         #Find out what cells are needed to cover the Placemark
-        cells = _spatial_index(pm, scale)
+        cells = _spatial_index(pm, scale, keys)
         
         #add mappings from each of those cells to the current Placemark
         #into the index
+        if classify:
+            rim = _rim_cells(_geometry_parts(pm), scale, keys)
+            for cell in cells:
+                index.add(cell, i, cell in rim)
+            continue
         for cell in cells:
             try:
                 pool = index[cell]
@@ -436,6 +643,140 @@ def spatial_index(soup, scale=16):
             pool.add(i)
     return index
 
+def spatial_quadtree(soup, scale=16, min_scale=8, capacity=0):
+    """Return a multi-resolution spatial index of the Placemarks in `soup`.
+
+       Like `spatial_index`, but instead of indexing every Placemark at one
+       fixed `scale`, start with cells of `min_scale` and split a cell into
+       its four children only if the boundary of some Placemark in it
+       crosses it and it has more than `capacity` Placemarks. So the inside
+       of a big polygon is covered by a few coarse cells and only the cells
+       along boundaries are refined, as far as `scale`.
+
+       :param soup: a KML document (bs4.BeautifulSoup or lxml.etree)
+       :param scale: the finest scale of cells in the index
+       :param min_scale: the coarsest scale of cells in the index
+       :param capacity: leave a cell crossed by boundaries unsplit if it has
+       no more than this many Placemarks
+       :returns: a `spindex.QuadtreeIndex` from int cell keys to sets of ints
+       (indices into the list of Placemarks), which, like the index from
+       `spatial_index(..., classify=True)`, records which Placemarks'
+       boundaries cross each cell
+       """
+    if not 0 < min_scale <= scale:
+        raise ValueError('need 0 < min_scale <= scale')
+    pms = _etree.find_all(soup, 'Placemark')
+    parts = [_geometry_parts(pm) for pm in pms]
+    index = sx.QuadtreeIndex(min_scale, scale)
+    
+    #map each cell of the current level to the Placemarks containing all of
+    #it and the Placemarks whose boundaries cross it
+    level = {}
+    for i, pm in enumerate(pms):
+        rim = _rim_cells(parts[i], min_scale)
+        for key in _spatial_index(pm, min_scale, keys=True):
+            full, partial = level.setdefault(key, (set(), set()))
+            (partial if key in rim else full).add(i)
+    
+    for s in range(min_scale, scale + 1):
+        rims = {}
+        fills = {}
+        next_level = {}
+        for key, (full, partial) in level.items():
+            if (s == scale or not partial or
+                    len(full) + len(partial) <= capacity):
+                index[key] = full | partial
+                if partial:
+                    index.boundary[key] = partial
+                continue
+            
+            #A child not crossed by a Placemark's boundary is either all
+            #inside it or all outside, so its center tells which
+            for child in sx.key_children(key):
+                child_full, child_partial = set(full), set()
+                x, y, _ = sx.key_indices(child, s + 1)
+                for i in partial:
+                    try:
+                        rim, fill = rims[i], fills[i]
+                    except KeyError:
+                        rim = rims[i] = _rim_cells(parts[i], s + 1)
+                        fill = fills[i] = _fill_rows(parts[i], s + 1)
+                    if child in rim:
+                        child_partial.add(i)
+                    elif bisect.bisect_right(fill.get(y, ()), x) % 2:
+                        child_full.add(i)
+                if child_full or child_partial:
+                    next_level[child] = (child_full, child_partial)
+        level = next_level
+    return index
+
+def _geometry_parts(pm):
+    """Return the rings (LinearRings), the other lines (LineStrings), and
+       the points of the geometry of Placemark `pm`."""
+    def lines(name):
+        return [coords_from_tag(_etree.find(line, 'coordinates'))
+                for line in _etree.find_all(pm, name)]
+    points = [coords_from_tag(_etree.find(pt, 'coordinates'))[0]
+              for pt in _etree.find_all(pm, 'Point')]
+    return lines('LinearRing'), lines('LineString'), points
+
+def _rim_cells(parts, scale, keys=True):
+    """Return the set of the cells at `scale` crossed by the boundary of a
+       Placemark, given its `_geometry_parts`.
+
+       :param keys: if True, return int keys of cells instead of cells
+       """
+    rings, lines, points = parts
+    get_cell, get_cells_1d = ((sx.get_key, sx.get_keys_1d) if keys else
+                              (sx.get_cell, sx.get_cells_1d))
+    rim = {get_cell(point, scale) for point in points}
+    for line in itertools.chain(rings, lines):
+        rim |= get_cells_1d(line, scale)
+    return rim
+
+def _fill_rows(parts, scale):
+    """Map each row of cells at `scale` to the sorted starts and stops of
+       the runs of cells in that row with their centers inside a Placemark,
+       given its `_geometry_parts`.
+
+       A cell is inside if an odd number of those numbers are <= its x."""
+    fill = {}
+    for y, x_start, x_stop in sx.get_ring_ranges_2d(parts[0], scale):
+        fill.setdefault(y, []).extend([x_start, x_stop])
+    return fill
+
+def save_spatial_index(index, filepath):
+    """Save a spatial index to a binary file for `load_spatial_index`.
+
+       The boundary of an index from `spatial_index(..., classify=True)` or
+       `spatial_quadtree` is saved too, so the loaded index can still
+       `classify` cells and `query_classified` points.
+
+       :param index: a dict from cells to sets of Placemark numbers, such as
+       from `spatial_index`
+       :param filepath: the name of the file to write
+       :returns: None
+       """
+    sx.save_index(index, filepath)
+
+def load_spatial_index(filepath, mmap=True):
+    """Load a spatial index saved by `save_spatial_index`.
+
+       The returned index maps int cell keys (see `spindex.cell_key`) to sets
+       of Placemark numbers like `spatial_index(..., keys=True)` does, but it
+       reads straight from the memory-mapped file, so there's nothing to
+       rebuild or deserialize.
+
+       If the index was saved with a boundary (see `save_spatial_index`), the
+       returned index can `classify` and `query_classified` like the saved
+       one; otherwise they report every Placemark as needing an exact test.
+
+       :param filepath: the name of the file to read
+       :param mmap: if False, read the whole file into memory instead
+       :returns: a `spindex.MappedIndex`
+       """
+    return sx.load_index(filepath, mmap)
+
 def spatial_index_stats(index):
     """Compute and return statistics about the quality of a spatial index.
 
@@ -447,6 +788,10 @@ def spatial_index_stats(index):
        (population-type, not sample) of the number of Placemarks intersected
        per cell.
 
+       Also report, under 'levels', the number of cells of each scale in the
+       index and the average and greatest number of Placemarks per cell of
+       that scale, which shows how a `spatial_quadtree` index was refined.
+
        :param index: a dict from mesh cell to a set of ints >= 0 (index into
        list of Placemarks), such as the return value of `spatial_index`
 
@@ -473,10 +818,18 @@ def spatial_index_stats(index):
 
     stdev = (sum((stat - avg)**2 for stat in stats) / len(stats)) ** 0.5
 
+    levels = {}
+    for cell, v in index.items():
+        scale = cell.scale if isinstance(cell, sx._Cell) else sx.key_scale(cell)
+        levels.setdefault(scale, []).append(len(v))
+    levels = {scale: {'cells':len(counts), 'avg':sum(counts) / len(counts),
+                      'max':max(counts)}
+              for scale, counts in sorted(levels.items())}
+
     return {'avg':avg, 'stdev':stdev, 'median':median, 'min':m, 'max':M,
-            'range':_range, 'data':stats}
+            'range':_range, 'data':stats, 'levels':levels}
 
-def _spatial_index(pm, scale):
+def _spatial_index(pm, scale, keys=False):
     """Choose the appropriate implementing function to index the Placemark.
 
        Defers to _spdx_mg, _spdx_pg, _spdx_ls, and _spdx_pt depending on
@@ -490,61 +843,73 @@ def _spatial_index(pm, scale):
        :param scale: the exponent of the denominator of the width and height of
        the indexing cells (in degrees)
 
+       :param keys: if True, return cells as int keys
+
        :returns: the Placemark's geometry (MultiGeometry, Polygon, LineString,
        or Point)
        """
     try:
         return next(iter(
-                f(tag, scale)
-                for tag, f in ([pm.find(name), func]
+                f(tag, scale, keys)
+                for tag, f in ([_etree.find(pm, name), func]
                                for name, func in _TAG_TO_FUNCTION.items())
-                if tag))
+                if tag is not None))
     except StopIteration:
         raise ValueError('Placemark has no Point, LineString, Polygon, or '
                          'MultiGeometry')
 
-def _spdx_pg(pg, scale):
+def _spdx_pg(pg, scale, keys=False):
     """Spatially index a Polygon."""
-    outer = coords_from_tag(pg.outerBoundaryIs.coordinates)
-    cells = _cells(outer, 2, scale)
-    for ibi in pg('innerBoundaryIs'):
-        inner = coords_from_tag(ibi.coordinates)
-        hole_rim  = _cells(inner, 1, scale)
-        hole_fill = _cells(inner, 2, scale, boundary_cells=hole_rim)
+    outer = coords_from_tag(_etree.find(_etree.find(pg, 'outerBoundaryIs'),
+                                        'coordinates'))
+    cells = _cells(outer, 2, scale, keys)
+    for ibi in _etree.find_all(pg, 'innerBoundaryIs'):
+        inner = coords_from_tag(_etree.find(ibi, 'coordinates'))
+        hole_rim  = _cells(inner, 1, scale, keys)
+        hole_fill = _cells(inner, 2, scale, keys, boundary_cells=hole_rim)
         cells -= (hole_fill - hole_rim)
     return cells
 
-def _spdx_ls(ls, scale):
+def _spdx_ls(ls, scale, keys=False):
     """Spatially index a LineString."""
-    return _cells(coords_from_tag(ls.coordinates), 1, scale)
+    return _cells(coords_from_tag(_etree.find(ls, 'coordinates')), 1, scale,
+                  keys)
 
-def _spdx_pt(pt, scale):
+def _spdx_pt(pt, scale, keys=False):
     """Spatially index a Point."""
-    return _cells(coords_from_tag(pt.coordinates)[0], 0, scale)
+    return {_cells(coords_from_tag(_etree.find(pt, 'coordinates'))[0], 0,
+                   scale, keys)}
 
-def _spdx_mg(mg, scale):
+def _spdx_mg(mg, scale, keys=False):
     """Spatially index a MultiGeometry."""
     cells = set()
-    for geom in mg(list(_TAG_TO_FUNCTION)):
-        cells.update(_TAG_TO_FUNCTION[geom.name](geom, scale))
+    for geom in _etree.find_all(mg, list(_TAG_TO_FUNCTION)):
+        cells.update(_TAG_TO_FUNCTION[_etree.name(geom)](geom, scale, keys))
     return cells
 
-def _cells(points, dim, scale, dim2func={0:sx.get_cell,
-                                         1:sx.get_cells_1d,
-                                         2:sx.get_cells_2d},
+def _cells(points, dim, scale, keys=False,
+           dim2func={0:sx.get_cell,
+                     1:sx.get_cells_1d,
+                     2:sx.get_cells_2d},
+           key_dim2func={0:sx.get_key,
+                         1:sx.get_keys_1d,
+                         2:sx.get_keys_2d},
            **named):
     """Return the spatial index cells intersecting `points`.
 
        :param points: a KML geometry element (Polygon, LineString, Point)
        :param dim: number of dimensions `points` internally has
        :param scale: exponential scale of spatial index mesh size
+       :param keys: if True, return int keys of cells, using `key_dim2func`
        :param dim2func: map from `dim` to the function that get cells for
        a geometry of that dimension
+       :param key_dim2func: map from `dim` to the function that gets keys of
+       cells for a geometry of that dimension
        :param named: named parameters to send to a function from dim2func
        """
     
     try:
-        func = dim2func[dim]
+        func = (key_dim2func if keys else dim2func)[dim]
     except KeyError:
         raise ValueError('dim must be 0, 1, or 2')
     return func(points, scale=scale, **named)
@@ -556,13 +921,13 @@ _TAG_TO_FUNCTION = {'MultiGeometry': _spdx_mg,
 
 from .styles import stylize
 
-def time_graph(files, sorter):
+def time_graph(files, sorter, workers=1):
     assert all(x.endswith('.kml' ) for x in files)
     soups = [open(file) for file in files]
     polygonsies = []
     for soup in soups:
-        polygons = [Polygon.from_kml(polygon, info=polygon)
-                    for polygon in soup('Placemark')]
+        pms = soup('Placemark')
+        polygons = load_polygons(pms, workers=workers, infos=pms)
         polygons.sort(key=(lambda poly : sorter(poly.info)))
         polygonsies.append(polygons)
     return set(itertools.chain.from_iterable(
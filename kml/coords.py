@@ -0,0 +1,299 @@
+"""An opt-in, compact store for the `<coordinates>` of a KML document.
+
+   Every call to `kml.coords_from_tag` parses the text of a `<coordinates>`
+   element, and `kml.stokes`, `kml.stokes_audit`, `Polygon.from_kml`, the
+   spatial indexing functions, and the extreme-coordinate functions of
+   `kml.layers` each do it again for the same elements.
+
+   Nothing here happens unless `cache(soup)` is called. It parses every
+   `<coordinates>` element of `soup` into a `CoordinateStore`: one contiguous
+   `array('d')` of coordinate values plus an `array('q')` of offsets marking
+   where each ring starts. Until `uncache(soup)`, those functions read the
+   values from the store instead of parsing the text again.
+
+   `array` (used by `kml.stokes` and `kml.layers`) gives zero-copy, read-only
+   NumPy views of the store. `points` (and so `kml.coords_from_tag`, used by
+   `kml.stokes_audit`, `Polygon.from_kml`, and the spatial indexing
+   functions, which all work point by point in pure Python) still builds a
+   new list of tuples on every call.
+
+   Every read of a stored element first re-reads its text and checks its
+   length and hash, so an element whose text changes (e.g. via `kml.dock`) is
+   re-parsed the next time it's read; that check costs time proportional to
+   the length of the text.
+
+   `parse`, `parse_many`, and `parse_document` turn coordinate text straight
+   into NumPy arrays, one C-level pass per `<coordinates>` element instead of
+   a `str.split` and a `float()` call per value."""
+
+import weakref
+import array as _array
+
+from . import etree as _etree
+
+#Map id(document) to a reference to that document and its store. bs4 hashes
+#a tag by printing it, so documents can't be keys themselves. bs4 documents
+#are referenced weakly; lxml elements can't be, so an lxml document is held
+#until it's uncached.
+_STORES = {}
+
+class CoordinateStore:
+    """The coordinates of many `<coordinates>` elements in one flat buffer.
+
+       Ring `r` (the `r`th element added) has its points from
+       `offsets[r]` up to `offsets[r+1]`, and its values in `values` from
+       `offsets[r] * dims` up to `offsets[r+1] * dims`."""
+
+    def __init__(self, dims=2):
+        """:param dims: the number of dimensions kept per point"""
+        self.dims = dims
+        self.values = _array.array('d')
+        self.offsets = _array.array('q', [0])
+        self._rings = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, tag):
+        return self._entry(tag) is not None
+
+    def _entry(self, tag):
+        """Return the (ring, length, hash) entry for `tag`, or None if `tag`
+           is not stored or its text has changed since it was.
+
+           The text is read and, if its length matches, hashed again on every
+           call; Python caches the hash of a str object, but lxml makes a new
+           one for each read."""
+        entry = self._rings.get(_key(tag))
+        if entry is not None:
+            text = _etree.string(tag)
+            if entry[1] == len(text) and entry[2] == hash(text):
+                return entry
+        return None
+
+    def add(self, tag):
+        """Parse `tag` into the store (if needed) and return its ring number.
+           """
+        entry = self._entry(tag)
+        if entry is not None:
+            return entry[0]
+        text = _etree.string(tag)
+        dims = self.dims
+        data = parse(text, dims).tobytes()
+        try:
+            self.values.frombytes(data)
+        except BufferError: #views of the values are alive, so it can't grow
+            self.values = self.values + _array.array('d', data)
+        values = self.values
+        ring = len(self.offsets) - 1
+        self.offsets.append(len(values) // dims)
+
+        #Don't keep a bs4 `tag` or its text, which would keep the whole
+        #document alive. If `tag` dies and its id is reused, the new element
+        #only matches this entry if its text is the same, and then so are its
+        #coordinates.
+        self._rings[_key(tag)] = (ring, len(text), hash(text))
+        return ring
+
+    def span(self, tag):
+        """Return the first and last-plus-one point positions of `tag`."""
+        ring = self.add(tag)
+        return self.offsets[ring], self.offsets[ring + 1]
+
+    def view(self, tag):
+        """Return a zero-copy memoryview of the flat coordinate values of
+           `tag`.
+
+           Slice it with a step of `dims` to get one dimension: for example
+           `view(tag)[1::2]` has the latitudes of a two-dimensional store."""
+        start, stop = self.span(tag)
+        return memoryview(self.values)[start * self.dims:stop * self.dims]
+
+    def array(self, tag):
+        """Return a zero-copy (N, dims) float64 NumPy array of the points of
+           `tag`."""
+        import numpy as np
+        return np.frombuffer(self.view(tag), dtype=np.float64
+                             ).reshape(-1, self.dims)
+
+    def points(self, tag, first_n_coords=None):
+        """Return a new list of the points of `tag` as tuples of floats.
+
+           This skips parsing the text, but not building the list; use
+           `array` or `view` to read the points without copying them.
+
+           :param tag: a `<coordinates>` element
+           :param first_n_coords: keep only this many dimensions per point; no
+           more than `dims`
+           """
+        dims = self.dims
+        view = self.view(tag)
+        points = list(zip(*([iter(view)] * dims)))
+        if first_n_coords is not None and first_n_coords < dims:
+            points = [point[:first_n_coords] for point in points]
+        return points
+
+def cache(soup, dims=2):
+    """Parse all the `<coordinates>` in `soup` into a store and return it.
+
+       Nothing in this package calls this; call it on a document whose
+       coordinates will be read several times. Until `uncache(soup)` is called
+       (or a bs4 `soup` is discarded), reading the coordinates of any element
+       of `soup` through `points` (and so through `kml.coords_from_tag` and
+       everything built on it) copies them out of this store instead of
+       parsing them.
+
+       :param soup: a KML document (bs4.BeautifulSoup or lxml.etree element)
+       :param dims: the number of dimensions to keep per point
+       :returns: the `CoordinateStore` for `soup`
+       """
+    root = _root(soup)
+    store = lookup(root)
+    if store is None or store.dims != dims:
+        store = CoordinateStore(dims)
+        key = id(root)
+        if _etree.is_element(root):
+            ref = lambda : root
+        else:
+            ref = weakref.ref(root, lambda _ : _STORES.pop(key, None))
+        _STORES[key] = (ref, store)
+    for tag in _etree.find_all(root, 'coordinates'):
+        store.add(tag)
+    return store
+
+def uncache(soup):
+    """Discard the coordinate store of `soup`, if there is one."""
+    _STORES.pop(id(_root(soup)), None)
+
+def lookup(tag):
+    """Return the coordinate store for the document `tag` is in, or None."""
+    if not _STORES:
+        return None
+    root = _root(tag)
+    ref, store = _STORES.get(id(root), (None, None))
+    return store if ref is not None and ref() is root else None
+
+def array(coordinates_tag, dims=2):
+    """Return an (N, dims) float64 NumPy array of the points of a
+       `<coordinates>` element.
+
+       If the document has a store that keeps enough dimensions (see
+       `cache`), the array is a zero-copy, read-only view into it; otherwise
+       the element's text is parsed into a new array.
+
+       While such a view is alive, adding an element to the store (a new one,
+       or one whose text changed) copies all the store's values.
+
+       Raise ValueError if some point has fewer than `dims` values.
+
+       :param coordinates_tag: a KML <coordinates> element
+       :param dims: only keep this many dimensions per point
+       """
+    store = lookup(coordinates_tag)
+    if store is not None and dims <= store.dims:
+        points = store.array(coordinates_tag)[:, :dims]
+        points.flags.writeable = False
+        return points
+    return parse(_etree.string(coordinates_tag), dims)
+
+def points(coordinates_tag, first_n_coords=2):
+    """Return a list of points from a `<coordinates>` element.
+
+       Copy them out of the document's store if it has one that keeps enough
+       dimensions (see `cache`), and otherwise parse the element's text.
+
+       :param coordinates_tag: a KML <coordinates> element
+       :param first_n_coords: only convert this many dimensions per point
+       :returns: a list of tuples of floats
+       """
+    store = lookup(coordinates_tag)
+    if store is not None and first_n_coords <= store.dims:
+        return store.points(coordinates_tag, first_n_coords)
+    text = _etree.string(coordinates_tag)
+    try:
+        return list(map(tuple, parse(text, first_n_coords).tolist()))
+    except ValueError: #some points have fewer than `first_n_coords` dims
+        return [tuple([float(dim)
+                       for dim in chunk.split(',')][:first_n_coords])
+                for chunk in text.strip().split()]
+
+def parse(text, dims=2):
+    """Parse the text of a `<coordinates>` element into a NumPy array.
+
+       When every point has the same number of values (the usual case), all
+       of them are read in one call to `numpy.fromstring`.
+
+       Raise ValueError if some point has fewer than `dims` values.
+
+       :param text: coordinate text like '-90.1,30.2,0 -90.3,30.4,0'
+       :param dims: only keep this many dimensions per point
+       :returns: an (N, dims) float64 array
+       """
+    import numpy as np
+    text = text.strip()
+    if not text:
+        return np.empty((0, dims))
+    chunks = text.split()
+    width = chunks[0].count(',') + 1
+    #the totals of values and commas can add up even when the widths are
+    #mixed (1,2,3 4,5 6,7,8,9), so check every point's width
+    if width >= dims and all(chunk.count(',') == width - 1
+                             for chunk in chunks):
+        values = np.fromstring(text.replace(',', ' '), sep=' ')
+        if values.size == len(chunks) * width:
+            points = values.reshape(len(chunks), width)
+            return points if width == dims else points[:, :dims].copy()
+    
+    #points of different widths; read them one at a time
+    points = [chunk.split(',')[:dims] for chunk in chunks]
+    if any(len(point) < dims for point in points):
+        raise ValueError(f'some points have fewer than {dims} dimensions')
+    return np.array(points, dtype=np.float64)
+
+def parse_many(texts, dims=2):
+    """Parse the texts of many `<coordinates>` elements into one array.
+
+       :param texts: an iterable of coordinate texts
+       :param dims: only keep this many dimensions per point
+       :returns: an (N, dims) float64 array of all the points in order, and an
+       int64 array of offsets such that the points of `texts[i]` are
+       `points[offsets[i]:offsets[i+1]]`
+       """
+    import numpy as np
+    rings = [parse(text, dims) for text in texts]
+    offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    np.cumsum([len(ring) for ring in rings], out=offsets[1:])
+    if not rings:
+        return np.empty((0, dims)), offsets
+    return np.concatenate(rings), offsets
+
+def parse_document(soup, dims=2):
+    """Parse every `<coordinates>` element in `soup` into one array.
+
+       :param soup: a KML document or element (bs4 or lxml.etree)
+       :param dims: only keep this many dimensions per point
+       :returns: the points and offsets as from `parse_many`, and the list of
+       `<coordinates>` elements in the same order
+       """
+    tags = _etree.find_all(soup, 'coordinates')
+    points, offsets = parse_many((_etree.string(tag) for tag in tags), dims)
+    return points, offsets, tags
+
+def _key(tag):
+    """Return the key of the `<coordinates>` element `tag` in a store.
+
+       lxml makes a new proxy object for an element each time it's reached
+       from its parent unless a proxy for it is still alive, so an lxml
+       element's id is only stable while something holds the element. The
+       store holds lxml elements themselves as keys (an lxml document is held
+       until it's uncached anyway), and bs4 tags, which are ordinary objects,
+       by id."""
+    return tag if _etree.is_element(tag) else id(tag)
+
+def _root(tag):
+    """Return the document `tag` belongs to (or its topmost ancestor)."""
+    if _etree.is_element(tag):
+        return tag.getroottree().getroot()
+    while tag.parent is not None:
+        tag = tag.parent
+    return tag
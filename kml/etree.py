@@ -0,0 +1,262 @@
+"""An lxml.etree backend for KML documents.
+
+   The rest of the package is written against bs4.BeautifulSoup documents,
+   which are pure python and slow to build, search, and print for big files.
+   This module parses, formats, and serializes KML as lxml.etree trees
+   instead, and supplies small accessors (`find`, `find_all`, `string`, etc.)
+   that work on either kind of tree so that helpers like `kml.get_data`,
+   `kml.add`, `kml.dock`, and `kml.coords_from_tag` accept both.
+
+   A formatted lxml tree keeps its root element in the KML namespace, but
+   every other element from the KML namespace is renamed to its plain local
+   name (`'Placemark'`, not `'{http://www.opengis.net/kml/2.2}Placemark'`).
+   That lets elements be looked up by the same plain names used with bs4, and
+   it serializes without any "kml:" prefixes, which is what `kml.io.format`
+   does for bs4 documents."""
+
+from lxml import etree as _etree
+
+KML_NS = 'http://www.opengis.net/kml/2.2'
+_NSMAP = {None   : KML_NS,
+          'gx'   : 'http://www.google.com/kml/ext/2.2',
+          'atom' : 'http://www.w3.org/2005/Atom'}
+
+#Every KML namespace Google Earth has ever written. Elements in any of these
+#lose their namespace when formatted.
+_KML_NAMESPACES = {KML_NS,
+                   'http://earth.google.com/kml/2.0',
+                   'http://earth.google.com/kml/2.1',
+                   'http://earth.google.com/kml/2.2'}
+
+_PARSER = _etree.XMLParser(remove_blank_text=True,
+                           strip_cdata=False,
+                           huge_tree=True)
+
+#CDATA costs this many characters: len('<![CDATA[') + len(']]>')
+_CDATA_COST = 12
+
+#extra characters spent on each char if it's escaped as an HTML entity
+_ESCAPE_COST = {'<': 3, '>': 3, '&': 4}
+
+def is_element(thing):
+    """Return True if `thing` is an lxml.etree element, False otherwise."""
+    return isinstance(thing, _etree._Element)
+
+def open(filepath, encoding=None):
+    """Read `filepath` and parse it as a KML document (lxml.etree element).
+
+       :param filepath: the name of or relative path to a KML file
+       :param encoding: optional character encoding (rarely needed)
+       :returns: the root element of a formatted KML document
+       """
+    parser = _PARSER
+    if encoding is not None:
+        parser = _etree.XMLParser(remove_blank_text=True,
+                                  strip_cdata=False,
+                                  huge_tree=True,
+                                  encoding=encoding)
+    return formatted(_etree.parse(filepath, parser).getroot())
+
+def parse(filetext):
+    """Parse `filetext` as a KML document.
+
+       :param filetext: Either valid XML (str or bytes) or a file-like object
+       :returns: the root element of a formatted KML document
+       """
+    if hasattr(filetext, 'read'):
+        return formatted(_etree.parse(filetext, _PARSER).getroot())
+    if isinstance(filetext, str):
+        filetext = filetext.encode('utf-8')
+    return formatted(_etree.fromstring(filetext, _PARSER))
+
+def tostring(root):
+    """Return the text of the KML document or element `root`."""
+    if root.getparent() is None:
+        return _etree.tostring(root,
+                               xml_declaration=True,
+                               encoding='UTF-8').decode('utf-8')
+    return _etree.tostring(root, encoding='unicode')
+
+def save(root, filepath):
+    """Save `root` to a file at `filepath`.
+
+       :param root: a KML document (lxml.etree element)
+       :param filepath: the name of the file to save, or a binary file-like
+       object to write to
+       :returns: None
+       """
+    _etree.ElementTree(root).write(filepath,
+                                   xml_declaration=True,
+                                   encoding='UTF-8')
+
+def format(root, no_empty=False):
+    """Trim whitespace, drop KML namespaces, wrap CDATA, and drop empty tags.
+
+       This is the lxml counterpart of `kml.io.format`.
+
+       lxml can't change the namespace prefixes of an element in place, so if
+       `root` is prefixed (`<kml:kml>`), its children are moved to a new root
+       element in the same namespace as its default namespace, which keeps
+       the elements renamed to plain names in the KML namespace. Use the
+       returned root instead of `root` then.
+
+       :param root: a KML document (lxml.etree element)
+       :param no_empty: if True, remove empty tags. Default False.
+       :returns: the root of the formatted document
+       """
+    root = _unprefixed(root)
+    empty = []
+    for e in root.iter():
+        if not isinstance(e.tag, str): #comment or processing instruction
+            continue
+        if e is not root:
+            namespace, _, local = e.tag[1:].rpartition('}')
+            if namespace in _KML_NAMESPACES:
+                e.tag = local
+        if e.tail is not None:
+            e.tail = e.tail.strip() or None
+        if e.text is not None:
+            text = e.text.strip()
+            if not text:
+                e.text = None
+            elif _prefer_cdata(text):
+                e.text = _etree.CDATA(text)
+            elif text != e.text:
+                e.text = text
+        if no_empty and e.text is None and not len(e):
+            empty.append(e)
+    _etree.cleanup_namespaces(root)
+    for e in empty:
+        _remove(e)
+    return root
+
+def formatted(root, **kwargs):
+    """Format `root` and return it (or the root replacing it; see `format`).
+       Convenience function wrapping `format`."""
+    return format(root, **kwargs)
+
+def _unprefixed(root):
+    """Return `root` if it's not a prefixed KML element, and otherwise a new
+       root element with the same namespace (as the default namespace),
+       attributes, text, and children."""
+    qname = _etree.QName(root)
+    if root.prefix is None or qname.namespace not in _KML_NAMESPACES:
+        return root
+    nsmap = {prefix: namespace
+             for prefix, namespace in root.nsmap.items()
+             if prefix is not None and prefix != root.prefix}
+    nsmap[None] = qname.namespace
+    new = _etree.Element(root.tag, attrib=dict(root.attrib), nsmap=nsmap)
+    new.text = root.text
+    new.extend(root) #moves the children
+    return new
+
+def _prefer_cdata(text):
+    """Return True if `text` prints shorter as CDATA than with HTML entities.
+       """
+    if ']]>' in text:
+        return False
+    extra = sum(text.count(c) * cost for c, cost in _ESCAPE_COST.items())
+    return extra and _CDATA_COST <= extra
+
+def _remove(e):
+    """Remove `e` from its parent, if any."""
+    parent = e.getparent()
+    if parent is not None:
+        parent.remove(e)
+
+def name(tag):
+    """Return the name of `tag` without any namespace or prefix."""
+    if is_element(tag):
+        return _etree.QName(tag).localname
+    return tag.name
+
+def find_all(tag, names, recursive=True):
+    """Return a list of the elements under `tag` with any of the `names`.
+
+       :param tag: a bs4 Tag or BeautifulSoup, or an lxml.etree element
+       :param names: an element name or a list of them, or True for all
+       elements
+       :param recursive: if False, only search the children of `tag`
+       :returns: a list of elements
+       """
+    if not is_element(tag):
+        return tag(names, recursive=recursive)
+    if names is True:
+        names = [_etree.Element]
+    elif isinstance(names, str):
+        names = [names]
+    if recursive:
+        return [e for e in tag.iter(*names) if e is not tag]
+    return [e for e in tag.iterchildren(*names)]
+
+def find(tag, name):
+    """Return the first element named `name` under `tag`, or None."""
+    if not is_element(tag):
+        return tag.find(name)
+    return next((e for e in tag.iter(name) if e is not tag), None)
+
+def string(tag):
+    """Return the text directly inside `tag`."""
+    return tag.text if is_element(tag) else tag.string
+
+def set_string(tag, text):
+    """Replace the content of `tag` with `text`."""
+    if is_element(tag):
+        for child in list(tag):
+            tag.remove(child)
+        tag.text = text
+    else:
+        tag.string = text
+
+def to_string(tag):
+    """Return the KML text of `tag`."""
+    return tostring(tag) if is_element(tag) else str(tag)
+
+def decompose(tag):
+    """Remove `tag` and everything in it from its document."""
+    if is_element(tag):
+        _remove(tag)
+    else:
+        tag.decompose()
+
+def get_data(pm, name=None):
+    """The lxml counterpart of `kml.get_data`."""
+    if name is None:
+        names = [d.get('name')
+                 for d in pm.iter('Data', 'SimpleData')
+                 if 'name' in d.attrib]
+        values = get_data(pm, names)
+        pairs = list(zip(names, values))
+        dic = {x:y for x,y in pairs}
+        return dic if len(dic) == len(pairs) else pairs
+    elif not isinstance(name, str) and hasattr(name, '__iter__'):
+        return [get_data(pm, n) for n in name]
+    for val in pm.iter('Data', 'SimpleData'):
+        if val.get('name') == name:
+            if val.tag == 'Data':
+                val = find(val, 'value')
+            string = None if val is None else val.text
+            return '' if string is None else string.strip()
+    raise ValueError("Data/SimpleData not found: name='"+str(name)+"'")
+
+def add(tag, name):
+    """The lxml counterpart of `kml.add`."""
+    if isinstance(name, (list, tuple)):
+        pointer = tag
+        for n in name:
+            pointer = add(pointer, n)
+        return pointer
+    return _etree.SubElement(tag, name)
+
+def new_root(name=None):
+    """Create and return a new, empty KML document (lxml.etree element).
+
+       :param name: a name for the kml document, added in a `<name>` tag
+       :returns: the root `<kml>` element
+       """
+    root = _etree.Element('{%s}kml' % KML_NS, nsmap=_NSMAP)
+    document = _etree.SubElement(root, 'Document')
+    if name is not None:
+        _etree.SubElement(document, 'name').text = name
+    return root
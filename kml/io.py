@@ -1,32 +1,163 @@
+from bs4.dammit import EntitySubstitution
 from bs4.element import CData, NavigableString, Tag
+from bs4.formatter import XMLFormatter
 from bs4 import BeautifulSoup
 
 _OPEN = open
 
-def open(filepath, encoding=None):
+REPLACE = {'<': '&lt;',
+           '>': '&gt;',
+           '&': '&amp;'}
+
+def open(filepath, encoding=None, backend='bs4'):
     """Read `filepath` and parse it as a KML document (bs4.BeautifulSoup).
        
        :param filepath: the name of or relative path to a KML file
        :param encoding: optional character encoding (rarely needed)
+       :param backend: 'bs4' (default) for a bs4.BeautifulSoup or 'lxml' for
+       a much faster lxml.etree tree (see `kml.etree`)
        :returns: a formatted KML document
        """
+    if _backend(backend) == 'lxml':
+        from . import etree
+        return etree.open(filepath, encoding=encoding)
     return formatted(BeautifulSoup(_OPEN(filepath, encoding=encoding),
                                    'xml'))
 
-def parse(filetext):
+def parse(filetext, backend='bs4'):
     """Parse `filetext` as a KML document.
 
-       :param filetext: Either valid XML or a file-like object"""
+       :param filetext: Either valid XML or a file-like object
+       :param backend: 'bs4' (default) or 'lxml'; see `open`"""
+    if _backend(backend) == 'lxml':
+        from . import etree
+        return etree.parse(filetext)
     return formatted(BeautifulSoup(filetext, 'xml'))
 
 def save(soup, filepath):
     """Save `soup` to a file at `filepath`.
 
-       :param soup: a KML document (bs4.BeautifulSoup)
+       The document is written piece by piece as its tree is walked (see
+       `write`) rather than first being built into one giant string.
+
+       :param soup: a KML document (bs4.BeautifulSoup or lxml.etree element)
        :param filepath: the name of the file to save
        :returns: None
        """
-    _OPEN(filepath, 'w').write(str(soup))
+    from . import etree
+    if etree.is_element(soup):
+        etree.save(soup, filepath)
+        return
+    with _OPEN(filepath, 'w', encoding='utf-8') as file:
+        write(soup, file)
+
+_CHUNK_SIZE = 1 << 16
+
+def write(soup, file, chunk_size=_CHUNK_SIZE):
+    """Write the text of `soup` to the text-mode `file` in chunks.
+
+       The output is the same as `str(soup)`, but it's produced by walking the
+       tree and handing `file` about `chunk_size` characters at a time, so
+       memory use does not depend on the size of the document. Run `format`
+       first to get CDATA and no "kml:" prefixes in the output.
+
+       :param soup: a KML document (bs4.BeautifulSoup) or element
+       (bs4.element.Tag)
+       :param file: a writable text file-like object
+       :param chunk_size: roughly how many characters to write at once
+       :returns: None
+       """
+    buffer = []
+    size = 0
+    for piece in _pieces(soup):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            file.write(''.join(buffer))
+            buffer.clear()
+            size = 0
+    file.write(''.join(buffer))
+
+_FORMATTER = XMLFormatter.REGISTRY['minimal']
+
+def _pieces(soup):
+    """Yield the text of `soup` in order, one tag or string at a time."""
+    if isinstance(soup, BeautifulSoup):
+        yield '<?xml version="1.0" encoding="utf-8"?>\n'
+        stack = list(reversed(soup.contents))
+    else:
+        stack = [soup]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            if isinstance(node, NavigableString):
+                node = node.output_ready(_FORMATTER)
+            yield node #a string or a closing tag from below
+            continue
+        name = node.prefix + ':' + node.name if node.prefix else node.name
+        attrs = ''.join(_attribute(k, v) for k,v in _FORMATTER.attributes(node))
+        if node.is_empty_element:
+            yield f'<{name}{attrs}/>'
+        else:
+            yield f'<{name}{attrs}>'
+            stack.append(f'</{name}>')
+            stack.extend(reversed(node.contents))
+
+def _attribute(key, value):
+    """Return the text of an attribute as it appears in a start tag."""
+    if value is None:
+        return ' ' + key
+    if isinstance(value, (list, tuple)):
+        value = ' '.join(value)
+    text = _FORMATTER.attribute_value(str(value))
+    return f' {key}={EntitySubstitution.quoted_attribute_value(text)}'
+
+_BACKENDS = ('bs4', 'lxml')
+
+def _backend(backend):
+    """Return `backend` if it names a supported backend. Raise ValueError
+       otherwise."""
+    if backend not in _BACKENDS:
+        raise ValueError(f'backend must be one of {_BACKENDS}: {backend!r}')
+    return backend
+
+def iter_placemarks(filepath, **kwargs):
+    """Read `filepath` one Placemark at a time without parsing the whole file.
+
+       Each `<Placemark>` is cut out of an incremental (lxml.etree.iterparse)
+       parse of the file as soon as its end tag is read, parsed on its own as
+       a small formatted KML document, and yielded. The raw element and any
+       already-handled siblings before it are then freed, so memory use stays
+       roughly that of the biggest single Placemark no matter how big the
+       file is.
+
+       :param filepath: the name of or relative path to a KML file, or a
+       binary file-like object
+       :param kwargs: passed to `format`
+       :returns: a generator of `<Placemark>` elements (bs4.element.Tag), each
+       the only Placemark in its own bs4.BeautifulSoup
+       """
+    from lxml import etree
+    
+    for _, elem in etree.iterparse(filepath,
+                                   events=('end',),
+                                   remove_blank_text=True,
+                                   huge_tree=True):
+        if not isinstance(elem.tag, str) or _local(elem.tag) != 'Placemark':
+            continue
+        soup = formatted(BeautifulSoup(etree.tostring(elem), 'xml'), **kwargs)
+        yield soup.Placemark
+        
+        #drop the element's content and every finished sibling before it so
+        #the partial tree held by iterparse does not grow with the file
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+
+def _local(tag):
+    """Return `tag` (an lxml tag name) without its {namespace} or prefix."""
+    return tag.rpartition('}')[2].rpartition(':')[2]
 
 def format(soup, no_empty=False):
     """Remove all leading and trailing whitespace on all strings in `soup`, 
@@ -74,32 +205,59 @@ def format(soup, no_empty=False):
        :returns: None
        """
     
-    strip = []
-    destroy = []
-    for e in soup.descendants:
-        if isinstance(e, NavigableString):
-            if e.isspace():
-                destroy.append(e) #remove empty strings
-            elif e.strip() != e:
-                strip.append(e) #trim trimmable strings
-        elif isinstance(e, Tag):
-            if e.prefix == "kml":
-                e.prefix = None #remove kml: prefixes
-            if e.string and e.string.parent is e: #.string works indirectly
-                e.string = e.string.strip() #trim some trimmable strings
-                if any(c in e.string for c in REPLACE):
-                    cdata = CData(e.string)
-                    if len(str(cdata)) <= len(_as_html(e.string)):
-                        e.string = cdata #use CDATA to wrap HTML
-    for d in destroy:
-        d.extract()
-    for s in strip:
-        s.replace_with(s.strip())
-    if no_empty:
-        for tag in soup(lambda thing : isinstance(thing,Tag) and
-                        len(list(thing.contents)) == 0):
+    #One pass over the tree, parents before children. Each tag cleans up its
+    #own direct contents, so nothing is ever visited after it's been replaced
+    #or removed.
+    stack = [soup]
+    while stack:
+        tag = stack.pop()
+        if tag.prefix == "kml":
+            tag.prefix = None #remove kml: prefixes
+        contents = tag.contents
+        #walk backwards so that removals don't shift the indices still to be
+        #visited, and pass those indices along so bs4 doesn't search for them
+        for i in range(len(contents) - 1, -1, -1):
+            child = contents[i]
+            if isinstance(child, Tag):
+                stack.append(child)
+            elif child.isspace():
+                child.extract(_self_index=i) #remove empty strings
+            elif len(contents) != 1:
+                stripped = child.strip()
+                if stripped != child:
+                    child.replace_with(stripped) #trim trimmable strings
+        if len(contents) == 1 and type(contents[0]) in _TEXT_TYPES:
+            _format_string(tag, contents[0])
+        elif no_empty and not contents and tag is not soup:
             tag.decompose()
 
+_TEXT_TYPES = (NavigableString, CData)
+
+#len('<![CDATA[') + len(']]>')
+_CDATA_COST = 12
+
+#extra characters each char in REPLACE costs when it's escaped
+_ESCAPE_COST = {k: len(v) - len(k) for k,v in REPLACE.items()}
+
+def _format_string(tag, string):
+    """Trim `string`, the only content of `tag`, and make it CDATA if it
+       already was or if that prints no longer than escaping it.
+
+       The lengths are compared arithmetically: CDATA always costs
+       `_CDATA_COST` more characters and escaping costs `_ESCAPE_COST` more
+       for each special character.
+       """
+    stripped = string.strip()
+    escape_cost = sum(stripped.count(c) * cost
+                      for c, cost in _ESCAPE_COST.items())
+    if type(string) is CData or escape_cost and _CDATA_COST <= escape_cost:
+        new_type = CData #use CDATA to wrap HTML
+    else:
+        new_type = NavigableString
+    if type(string) is not new_type or stripped != string:
+        string.extract(_self_index=0)
+        tag.append(new_type(stripped))
+
 def formatted(soup, **kwargs):
     """Format `soup` and return it. Convenience function wrapping `format`.
     
@@ -111,10 +269,6 @@ def formatted(soup, **kwargs):
     format(soup, **kwargs)
     return soup
 
-REPLACE = {'<': '&lt;',
-           '>': '&gt;',
-           '&': '&amp;'}
-
 def _as_html(string):
     """Return a copy of `string` where all less-thans, greater-thans, 
        and ampersands are replaced by their HTML character entity equivalents.
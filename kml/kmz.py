@@ -1,17 +1,27 @@
+import io
 import zipfile
 from zipfile import ZipFile
 
-from .io import parse as parsekml
+from . import etree
+from .io import parse as parsekml, write as writekml
 
-def open(filename):
-    """Put in a KMZ file's name, get out a KML soup."""
+def open(filename, backend='bs4'):
+    """Put in a KMZ file's name, get out a KML soup (or lxml.etree tree)."""
     with ZipFile(filename) as kmz:
-        return parsekml(kmz.open(kmz.namelist()[0]))
+        return parsekml(kmz.open(kmz.namelist()[0]), backend=backend)
 
 def save(soup, filename):
-    """Save a KML soup as a KMZ file."""
+    """Save a KML soup (or lxml.etree tree) as a KMZ file.
+
+       The document is streamed into the archive as it's serialized instead of
+       being built into one string first."""
     with ZipFile(filename, mode='w', compression=zipfile.ZIP_DEFLATED) as kmz:
-        kmz.writestr('doc.kml', str(soup))
+        with kmz.open('doc.kml', mode='w') as entry:
+            if etree.is_element(soup):
+                etree.save(soup, entry)
+            else:
+                with io.TextIOWrapper(entry, encoding='utf-8') as text:
+                    writekml(soup, text)
 
 def compress(kmlfile, replace=False):
     """Compress an existing KML file to KMZ. Optionally remove the original."""
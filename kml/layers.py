@@ -9,6 +9,8 @@ import itertools
 
 from bs4.element import Tag
 from .io import open as openkml
+from . import coords as _coords
+from . import etree as _etree
 
 import point_in_polygon
 
@@ -22,8 +24,8 @@ def filter_kmllayer(soup, exceptions=STD_EXCEPTIONS):
        element's name maps to in `KMLLAYER_TAG_SUPPORT` and inverted if that
        name is present in `exceptions`.
        
-       `soup` : the KML soup (bs4) to be processed for use with the KmlLayer
-                class in the Google Maps Javascript API
+       `soup` : the KML soup (bs4 or lxml.etree) to be processed for use with
+                the KmlLayer class in the Google Maps Javascript API
        `exceptions` : a list of KML tag names whose removal/retention status
                       should be the opposite of what `KMLLAYER_TAG_SUPPORT`
                       indicates.  Defaults to `STD_EXCEPTIONS`
@@ -35,15 +37,16 @@ def filter_kmllayer(soup, exceptions=STD_EXCEPTIONS):
     
     actions = {
          1: (lambda x : None),
-        -1: (lambda x : x.decompose())}
+        -1: _etree.decompose}
     keep = 1
     decomp = -1
-    for tag in soup(True):
+    for tag in _etree.find_all(soup, True):
+        name = _etree.name(tag)
         action = (decomp
-                  if (tag.name not in KMLLAYER_TAG_SUPPORT or
-                      KMLLAYER_TAG_SUPPORT[tag.name].lower().startswith('n'))
+                  if (name not in KMLLAYER_TAG_SUPPORT or
+                      KMLLAYER_TAG_SUPPORT[name].lower().startswith('n'))
                   else keep)
-        if tag.name in exceptions:
+        if name in exceptions:
             action *= -1
         actions[action](tag)
 
@@ -214,11 +217,11 @@ KMLLAYER_TAG_SUPPORT = {
 
 def _extrem_dir(pm, get_dim, comp):
     val = None
-    for coord_tag in pm("coordinates"):
-        for point in [tuple(float(t)
-                            for t in triple.split(','))
-                      for triple in coord_tag.string.strip().split()]:
-            d = get_dim(point)
+    for coord_tag in _etree.find_all(pm, "coordinates"):
+        points = _coords.array(coord_tag)
+        if len(points):
+            #`get_dim` picks a row of the transposed points: a whole dimension
+            d = comp(get_dim(points.T).tolist())
             val = d if val is None else comp(d,val)
     return val
 
@@ -254,10 +257,12 @@ def count(pms):
     return len(pms)
 
 def characters(pms):
-    return sum(len(str(pm)) for pm in pms)
+    return sum(len(_etree.to_string(pm)) for pm in pms)
 
 def _coord_string(pms):
-    return sum(sum(len(c.string) for c in pm("coordinates")) for pm in pms)
+    return sum(sum(len(_etree.string(c))
+                   for c in _etree.find_all(pm, "coordinates"))
+               for pm in pms)
 
 def _is_legal(pt, seq):
     return (0 < pt[0] and
@@ -397,12 +402,14 @@ def geojson(soup, get_properties=None):
     return {'type':'FeatureCollection',
             'features': list(itertools.chain.from_iterable(_features(
                     pm, get_properties)
-                    for pm in soup('Placemark')))}
+                    for pm in _etree.find_all(soup, 'Placemark')))}
 
 def _std_get_properties(pm):
+    from kml import get_data
     props = get_data(pm)
-    if pm.styleUrl:
-        props['style_id'] = pm.styleUrl.string[1:]
+    style_url = _etree.find(pm, 'styleUrl')
+    if style_url is not None:
+        props['style_id'] = _etree.string(style_url)[1:]
     return props
 
 def _jsonify_bound(bound):
@@ -27,7 +27,37 @@ def get_probe_points(side, probe_radius):
         x = ((1 + m**2) ** -0.5) * probe_radius
         return (xm + x, ym + m*x), (xm - x, ym - m*x)
 
-def fuzzy(shapes, probe_factor=1000, scale=16):
+def _probe_arrays(a, b, probe_radius):
+    """Return the probe points of many sides at once, as two (M, 2) arrays.
+
+       This is `get_probe_points` for NumPy arrays, with the same arithmetic.
+
+       :param a: (M, 2) float64 array of the first points of the sides
+       :param b: (M, 2) float64 array of the second points of the sides
+       :param probe_radius: distance between side midpoint and a probe point
+       """
+    import numpy as np
+    x1, y1, x2, y2 = a[:, 0], a[:, 1], b[:, 0], b[:, 1]
+    xm, ym = (x1+x2)/2, (y1+y2)/2
+    
+    north_south = x1 == x2
+    east_west = (y1 == y2) & ~north_south
+    slanted = ~(north_south | east_west)
+    
+    #offsets of the first probe point from the midpoint
+    dx = np.where(north_south, -probe_radius, 0.0)
+    dy = np.where(east_west, -probe_radius, 0.0)
+    p1 = np.column_stack((xm + dx, ym + dy))
+    p2 = np.column_stack((xm - dx, ym - dy))
+    
+    x1, y1, x2, y2, xm, ym = (c[slanted] for c in (x1, y1, x2, y2, xm, ym))
+    m = (x1 - x2) / (y2 - y1) #slope of line ortho to each side
+    x = ((1 + m**2) ** -0.5) * probe_radius
+    p1[slanted] = np.column_stack((xm + x, ym + m*x))
+    p2[slanted] = np.column_stack((xm - x, ym - m*x))
+    return p1, p2
+
+def fuzzy(shapes, probe_factor=1000, scale=16, batched=True, workers=1):
     """Identify adjacencies not detected by `seamless`.
 
        Identify the net boundaries among the shapes, for each side of each
@@ -42,8 +72,18 @@ def fuzzy(shapes, probe_factor=1000, scale=16):
        :param probe_factor: probe radius is side length divided by twice this
        :param scale: chop earth into 2**scale chunks to limit point-in-polygon
        tests
+       :param batched: if True (default), probe all the sides at once with
+       NumPy arrays (see `_fuzzy_batched`); if False, probe one side at a
+       time. Both give the same graph.
+       :param workers: if more than 1, index the shapes and test the probe
+       points tile by tile in this many processes (see `_containing_tiled`),
+       or None for one per CPU. Only used if `batched`. The graph is the same
+       for any number of workers.
        :returns: a set of ints (vertex) and frozensets of two ints (edges)"""
     
+    if batched:
+        return _fuzzy_batched(shapes, probe_factor, scale, workers)
+    
     #Isolate the non-seamless boundaries
     from stokes import stokes
     boundaries = []
@@ -61,31 +101,7 @@ def fuzzy(shapes, probe_factor=1000, scale=16):
                             for i in range(1, len(boundary)))
                         for boundary in stoked) ** 0.5) / 2 / probe_factor
     
-    #Create a mapping from latlong mesh cell on the surface of the earth to
-    #the shapes from `shapes` that intersect that cell
-    #The values in the dict are dicts so that they can act as sets without
-    #needing the `shapes` to be hashable.
-    import spindex
-    cell_to_shapes = {}
-    for i, shape in enumerate(shapes):
-
-        #gather cells
-        cells = set()
-        for outer in shape.outers:
-            cells.update(spindex.get_cells_2d(outer, scale=scale))
-        for inner in shape.inners:
-            d1 = spindex.get_cells_1d(inner, scale=scale)
-            d2 = spindex.get_cells_2d(inner, scale=scale, boundary_cells=d1)
-            cells -= (d2 - d1)
-
-        #add mapping from each cell to the current shape
-        for cell in cells:
-            if cell not in cell_to_shapes:
-                cell_to_shapes[cell] = {}
-            cell_to_shapes[cell][i] = shape
-    else:
-        cell_to_shapes = {cell:list(shape_dict.values())
-                          for cell, shape_dict in cell_to_shapes.items()}
+    cell_to_shapes = _cell_to_shapes(shapes, scale)
     
     #start building the graph with the vertices (as ints)
     graph = set(range(len(shapes)))
@@ -99,11 +115,8 @@ def fuzzy(shapes, probe_factor=1000, scale=16):
     for boundary in stoked:
         for i in range(1, len(boundary)):
             side = boundary[i-1:i+1]
-            shapes1, shapes2 = ({j
-                                 for j,s
-                                 in enumerate(cell_to_shapes[
-                                         spindex.get_cell(point)])
-                                 if point in s}
+            shapes1, shapes2 = (_shapes_at(point, shapes, cell_to_shapes,
+                                           scale)
                                 for point in get_probe_points(side,
                                                               probe_radius))
             
@@ -116,36 +129,601 @@ def fuzzy(shapes, probe_factor=1000, scale=16):
                     graph.add(frozenset([s1, s2]))
     return graph
 
-def seamless(shapes):
+def _cell_to_shapes(shapes, scale):
+    """Map from latlong mesh cell on the surface of the earth (as an int key
+       from spindex.cell_key) to the shapes from `shapes` that intersect that
+       cell, split into the indices of the shapes that cover the whole cell
+       and of the shapes whose boundaries cross it. A probe point in a cell
+       is certainly in the former, so only the latter need point-in-polygon
+       tests."""
+    cell_to_shapes = {}
+    for i, shape in enumerate(shapes):
+        inside, edge = shape.spatial_index(scale, keys=True, classify=True)
+        for cell in inside:
+            cell_to_shapes.setdefault(cell, ([], []))[0].append(i)
+        for cell in edge:
+            cell_to_shapes.setdefault(cell, ([], []))[1].append(i)
+    return cell_to_shapes
+
+def _fuzzy_batched(shapes, probe_factor, scale, workers=1):
+    """`fuzzy`, with every side's probe points made and tested at once.
+
+       The net sides come straight from the topology of the shapes'
+       boundaries (see `stokes._net_sides`) rather than from tracing them
+       into boundaries. The probe points of all of them are computed as
+       arrays, bucketed by mesh cell in one pass, and tested against each
+       candidate shape in one call of its `contains_points`."""
+    import numpy as np
+    from stokes import _net_sides
+    from topology import Topology
+    
+    graph = set(range(len(shapes)))
+    
+    #Isolate the non-seamless sides
+    boundaries = []
+    for shape in shapes:
+        boundaries.extend(o.array for o in shape.outers)
+        boundaries.extend(i.array[::-1] for i in shape.inners)
+    topology = Topology(boundaries)
+    del boundaries
+    starts, ends = _net_sides(topology)
+    if not len(starts):
+        return graph
+    a, b = topology.vertices[starts], topology.vertices[ends]
+    del topology
+    
+    #place the probe points as `fuzzy` does
+    d = b - a
+    probe_radius = (float((d[:, 0]**2 + d[:, 1]**2).min()) ** 0.5
+                    ) / 2 / probe_factor
+    probes1, probes2 = _probe_arrays(a, b, probe_radius)
+    del a, b, d
+    
+    #find the shapes containing each probe point
+    import os
+    if workers is None:
+        workers = os.cpu_count() or 1
+    probes = np.concatenate((probes1, probes2))
+    count = len(probes1)
+    del probes1, probes2
+    if workers <= 1:
+        rows, ids = _containing(probes, shapes,
+                                _cell_to_shapes(shapes, scale), scale)
+    else:
+        rows, ids = _containing_tiled(probes, shapes, scale, workers)
+    first = rows < count
+    sides1, shapes1 = rows[first], ids[first]
+    sides2, shapes2 = rows[~first] - count, ids[~first]
+    
+    #drop the shapes containing both probe points of a side
+    hits1 = (sides1 << 32) | shapes1
+    hits2 = (sides2 << 32) | shapes2
+    both = np.intersect1d(hits1, hits2)
+    keep1 = ~np.isin(hits1, both)
+    keep2 = ~np.isin(hits2, both)
+    sides1, shapes1 = sides1[keep1], shapes1[keep1]
+    sides2, shapes2 = sides2[keep2], shapes2[keep2]
+    
+    #link each shape on one side of a side with each shape on the other
+    order = np.argsort(sides2, kind='stable')
+    sides2, shapes2 = sides2[order], shapes2[order]
+    lo = np.searchsorted(sides2, sides1, 'left')
+    counts = np.searchsorted(sides2, sides1, 'right') - lo
+    total = int(counts.sum())
+    firsts = np.repeat(np.arange(len(sides1)), counts)
+    within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    u = shapes1[firsts]
+    v = shapes2[np.repeat(lo, counts) + within]
+    edges = np.unique((np.minimum(u, v) << 32) | np.maximum(u, v))
+    graph.update(map(frozenset, zip((edges >> 32).tolist(),
+                                    (edges & 0xFFFFFFFF).tolist())))
+    return graph
+
+#`_containing_tiled` splits the probe points into this many tiles per worker
+_TILES_PER_WORKER = 4
+
+def _containing_tiled(points, shapes, scale, workers):
+    """`_containing`, with the work split into tiles done in parallel.
+
+       The points are sorted by cell key, so runs of them are near each
+       other in space (see `spindex.cell_key`), and split into runs of about
+       equal size: the tiles. Each tile goes to a pool of processes with the
+       shapes whose bounding boxes meet the tile's bounding box widened by
+       one cell on every side, which includes every shape that any of the
+       tile's cells could list. Each process indexes those shapes and tests
+       the tile's points just as `_containing` does for all of them, so the
+       merged hits are the same as `_containing`'s.
+
+       :param points: an (N, 2) float64 array
+       :param workers: the number of processes
+       :returns: two int64 arrays as from `_containing`
+       """
+    import numpy as np
+    import spindex
+    from concurrent.futures import ProcessPoolExecutor
+    
+    order = np.argsort(spindex.get_keys(points, scale), kind='stable')
+    tiles = [rows for rows in np.array_split(order,
+                                             workers * _TILES_PER_WORKER)
+             if len(rows)]
+    width, height = spindex._Cell.dims(scale)
+    boxes = np.array([tuple(shape.bbox) for shape in shapes],
+                     dtype=np.float64).reshape(-1, 4)
+    nears = []
+    for rows in tiles:
+        x, y = (points[rows].min(axis=0) - (width, height)).tolist()
+        X, Y = (points[rows].max(axis=0) + (width, height)).tolist()
+        nears.append(np.flatnonzero((boxes[:, 0] <= X) & (boxes[:, 1] >= x) &
+                                    (boxes[:, 2] <= Y) & (boxes[:, 3] >= y)))
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_tile_hits,
+                                (points[rows] for rows in tiles),
+                                ([shapes[j] for j in near.tolist()]
+                                 for near in nears),
+                                (scale for _ in tiles)))
+    
+    rows = [tile[r] for tile, (r, _) in zip(tiles, results)]
+    ids = [near[i] for near, (_, i) in zip(nears, results)]
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return (np.concatenate(rows).astype(np.int64),
+            np.concatenate(ids).astype(np.int64))
+
+def _tile_hits(points, shapes, scale):
+    """Index `shapes` and find which of them contain each of `points`."""
+    return _containing(points, shapes, _cell_to_shapes(shapes, scale), scale)
+
+def _containing(points, shapes, cell_to_shapes, scale):
+    """Find which of `shapes` contain each of `points`.
+
+       :param points: an (N, 2) float64 array
+       :param cell_to_shapes: as built by `_cell_to_shapes`
+       :returns: two int64 arrays of the same length, such that each shape
+       `shapes[ids[k]]` contains the point `points[rows[k]]`
+       """
+    import numpy as np
+    import spindex
+    
+    #bucket the points by cell
+    cells, which = np.unique(spindex.get_keys(points, scale),
+                             return_inverse=True)
+    order = np.argsort(which, kind='stable')
+    bounds = np.searchsorted(which[order], np.arange(len(cells) + 1))
+    
+    #every point is in the shapes covering its cell, and is a candidate for
+    #the shapes whose boundaries cross its cell
+    rows, ids = [], []
+    test_rows, test_ids = [], []
+    for c, cell in enumerate(cells.tolist()):
+        inside, edge = cell_to_shapes.get(cell, ((), ()))
+        members = order[bounds[c]:bounds[c+1]]
+        for i in inside:
+            rows.append(members)
+            ids.append(np.full(len(members), i, dtype=np.int64))
+        for j in edge:
+            test_rows.append(members)
+            test_ids.append(np.full(len(members), j, dtype=np.int64))
+    
+    #test the candidates of each shape all at once
+    if test_rows:
+        test_rows = np.concatenate(test_rows)
+        test_ids = np.concatenate(test_ids)
+        order = np.argsort(test_ids, kind='stable')
+        test_rows, test_ids = test_rows[order], test_ids[order]
+        heads = np.flatnonzero(np.diff(test_ids, prepend=-1))
+        for head, stop in zip(heads.tolist(),
+                              np.append(heads[1:], len(test_ids)).tolist()):
+            candidates = test_rows[head:stop]
+            j = int(test_ids[head])
+            hit = shapes[j].contains_points(points[candidates])
+            rows.append(candidates[hit])
+            ids.append(test_ids[head:stop][hit])
+    
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return (np.concatenate(rows).astype(np.int64),
+            np.concatenate(ids).astype(np.int64))
+
+def _shapes_at(point, shapes, cell_to_shapes, scale):
+    """Return the set of indices of the `shapes` that contain `point`.
+
+       :param cell_to_shapes: map from cell key to the indices of the shapes
+       covering the cell and the indices of the shapes whose boundaries cross
+       it, as built in `fuzzy`
+       """
+    import spindex
+    inside, edge = cell_to_shapes.get(spindex.get_key(point, scale), ((), ()))
+    return set(inside).union(j for j in edge if point in shapes[j])
+
+def seamless(shapes, tolerance=None):
     """Return an adjacency graph assuming the shapes have no gaps or overlaps.
 
        :param shapes: a list of Polygons
+       :param tolerance: if given, snap vertices to a grid with this spacing
+       first, so that sides whose ends nearly match count as the same side
+       (see `topology.Topology`)
        :returns: a set of ints (vertex) and frozensets of two ints (edges)"""
     
     #get the graph started with the vertices
     graph = set(range(len(shapes)))
     
-    #build a mapping from each polygon-side to a set of the polygons that
-    #have that side (as int indices)
-    side_to_shapes = {}
-    for i, shape in enumerate(shapes):
-        for side in shape.sides:
-            key = frozenset(side)
-            try:
-                extant = side_to_shapes[key]
-            except KeyError:
-                side_to_shapes[key] = {i}
-            else:
-                extant.add(i)
-    
-    #Use that mapping to identify all pairs of neighboring polygons
+    #number the distinct vertices of all the shapes and key each side by
+    #the vertex ids at its ends, so that the same side has the same int key
+    #in every shape that has it
+    from topology import Topology
+    topology = Topology.from_polygons(shapes, tolerance)
+    keys, owners = topology.side_owners()
+    
+    #Sort the sides by key to find the pairs of shapes that share a side
     #Add each such pair to the graph as a frozenset of int indices
-    for side, pair in side_to_shapes.items():
-        if len(pair) == 1:
-            continue
-        elif len(pair) > 2:
-            raise Exception(
-                    f"one side maps to more than two shapes: {side} -> {pair}")
-        graph.add(frozenset(pair))
+    from topology import unpack
+    name = lambda key : frozenset(map(topology.point, map(int, unpack(key))))
+    graph.update(_shared_sides(keys, owners, name))
+    return graph
+
+#Bytes per side record in `seamless_chunked`: the coordinates of the side's
+#ends, lesser end first, and the index of the shape it belongs to
+_SIDE_RECORD = [('ends', '<f8', 4), ('owner', '<i8')]
+
+#`seamless_chunked` allows for sorting side records to take this many times
+#the bytes of the records themselves, plus slack for uneven buckets
+_SORT_OVERHEAD = 6
+
+def seamless_chunked(shapes, memory=2**30, tolerance=None, tempdir=None):
+    """Return the same graph as `seamless` using about `memory` bytes.
+
+       `seamless` holds a record of every side of every shape at once, which
+       for a national layer of precincts is far too much. This matches the
+       sides in pieces instead. A chunk of shapes at a time, the sides are
+       turned into (side, shape index) records and appended to one of
+       several bucket files on disk, chosen by a hash of the side's
+       coordinates so that every copy of a side goes to the same bucket.
+       Then each bucket is read back, sorted, and scanned for runs of equal
+       sides by itself. If all the records fit in `memory`, this just calls
+       `seamless`.
+
+       :param shapes: a list of Polygons
+       :param memory: roughly the most bytes to use for side records and
+       for sorting them
+       :param tolerance: see `seamless`
+       :param tempdir: where to put the bucket files (default: the system's
+       temporary directory)
+       :returns: a set of ints (vertex) and frozensets of two ints (edges)"""
+    import numpy as np
+    from topology import ring_arrays
+    dtype = np.dtype(_SIDE_RECORD)
+    side_count = sum(len(ring) - 1
+                     for shape in shapes for ring in ring_arrays(shape))
+    per_pass = max(1, memory // (dtype.itemsize * _SORT_OVERHEAD))
+    buckets = -(-side_count // per_pass)
+    if buckets <= 1:
+        return seamless(shapes, tolerance)
     
+    import os
+    import tempfile
+    graph = set(range(len(shapes)))
+    with tempfile.TemporaryDirectory(dir=tempdir) as folder:
+        paths = [os.path.join(folder, f'{b}.sides') for b in range(buckets)]
+        for records in _side_records(shapes, per_pass, tolerance):
+            which = _bucket_of(records['ends'], buckets)
+            order = np.argsort(which, kind='stable')
+            records = records[order]
+            bounds = np.searchsorted(which[order], np.arange(buckets + 1))
+            for b in np.flatnonzero(np.diff(bounds)).tolist():
+                with open(paths[b], 'ab') as f:
+                    records[bounds[b]:bounds[b+1]].tofile(f)
+            del records, which, order
+        for path in paths:
+            if os.path.exists(path):
+                graph.update(_bucket_pairs(np.fromfile(path, dtype),
+                                           tolerance))
+                os.remove(path)
     return graph
+
+def _side_records(shapes, size, tolerance=None):
+    """Generate arrays of the side records of about `size` sides at a time.
+
+       Each side's ends are ordered lesser first, so a side has the same
+       record whichever way its shape runs. Sides whose ends are equal (or
+       snap to the same grid point) are left out, as in `topology.Topology`.
+       """
+    import numpy as np
+    from topology import ring_arrays
+    rings, owners, count = [], [], 0
+    for i, shape in enumerate(shapes):
+        for ring in ring_arrays(shape):
+            rings.append(ring)
+            owners.append(i)
+            count += len(ring) - 1
+        if count >= size or i == len(shapes) - 1:
+            lengths = np.array([len(ring) for ring in rings], dtype=np.int64)
+            points = np.concatenate(rings) if rings else np.empty((0, 2))
+            if tolerance is not None:
+                points = np.round(points / tolerance)
+            points = points + 0.0 #-0.0 must hash like 0.0
+            ring_of = np.repeat(np.arange(len(rings)), lengths)
+            a, b = points[:-1], points[1:]
+            real = (ring_of[:-1] == ring_of[1:]) & (a != b).any(axis=1)
+            a, b = a[real], b[real]
+            swap = ((a[:, 0] > b[:, 0]) |
+                    ((a[:, 0] == b[:, 0]) & (a[:, 1] > b[:, 1])))[:, None]
+            records = np.empty(len(a), dtype=_SIDE_RECORD)
+            records['ends'] = np.hstack((np.where(swap, b, a),
+                                         np.where(swap, a, b)))
+            records['owner'] = np.array(owners)[ring_of[:-1][real]]
+            yield records
+            rings, owners, count = [], [], 0
+
+def _bucket_of(ends, buckets):
+    """Return the bucket number of each side from a hash of its ends."""
+    import numpy as np
+    bits = np.ascontiguousarray(ends).view(np.uint64)
+    h = np.zeros(len(bits), dtype=np.uint64)
+    for column in bits.T:
+        h = (h ^ column) * np.uint64(0x100000001B3)
+        h ^= h >> np.uint64(29)
+    return (h % np.uint64(buckets)).astype(np.intp)
+
+def _bucket_pairs(records, tolerance=None):
+    """Return the pairs of shapes that share a side among `records`."""
+    import numpy as np
+    ends, owners = records['ends'], records['owner']
+    order = np.lexsort(ends.T[::-1])
+    ends, owners = ends[order], owners[order]
+    new = np.ones(len(ends), dtype=bool)
+    new[1:] = (ends[1:] != ends[:-1]).any(axis=1)
+    keys = np.cumsum(new) - 1
+    firsts = np.flatnonzero(new)
+    unit = 1 if tolerance is None else tolerance
+    return _shared_sides(
+            keys, owners,
+            lambda key : frozenset(map(tuple, (ends[firsts[key]] * unit
+                                               ).reshape(2, 2).tolist())))
+
+def _shared_sides(keys, owners, name=str):
+    """Return the pairs of owners that have a side with the same key.
+
+       :param keys: int64 array of side keys
+       :param owners: int64 array of the owner of each side
+       :param name: function from a side key to a description of the side
+       for the error raised if the side has more than two owners
+       :returns: a set of frozensets of two ints
+       """
+    import numpy as np
+    order = np.lexsort((owners, keys))
+    keys, owners = keys[order], owners[order]
+    
+    #an owner with the same side twice only counts once
+    keep = np.ones(len(keys), dtype=bool)
+    keep[1:] = (keys[1:] != keys[:-1]) | (owners[1:] != owners[:-1])
+    keys, owners = keys[keep], owners[keep]
+    
+    #find the run of owners of each side
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    heads = np.flatnonzero(first)
+    counts = np.diff(np.append(heads, len(keys)))
+    crowded = np.flatnonzero(counts > 2)
+    if len(crowded):
+        head = heads[crowded[0]]
+        side = name(int(keys[head]))
+        pair = set(owners[head:head + counts[crowded[0]]].tolist())
+        raise Exception(
+                f"one side maps to more than two shapes: {side} -> {pair}")
+    pairs = heads[counts == 2]
+    return set(map(frozenset, zip(owners[pairs].tolist(),
+                                  owners[pairs + 1].tolist())))
+
+def snapped(shapes, tolerance, min_length=0.0, lengths=False, scale=None):
+    """Return an adjacency graph of the shapes whose boundaries come within
+       `tolerance` of each other.
+
+       This is a third way, next to `seamless` and `fuzzy`, to deal with
+       shapes that don't quite fit together. The vertices are snapped to a
+       grid with spacing `tolerance` (see `topology.Topology`), so nearly
+       equal vertices become equal. Every side is then filed in the cells of
+       a spatial index mesh (see `spindex.cell_key`) that it passes within
+       `tolerance` of. Only sides of different shapes that share a cell are
+       compared exactly.
+
+       For each pair of neighboring shapes, the length of their shared
+       boundary is the total length along which a side of each is within
+       `tolerance` of a side of the other. Shapes that only touch at a
+       corner share a boundary of length (nearly) 0, so a `min_length`
+       greater than 0 drops them.
+
+       :param shapes: a list of Polygons
+       :param tolerance: the greatest distance between sides that still
+       counts as touching, and the spacing of the snapping grid
+       :param min_length: the least shared-boundary length for an edge
+       :param lengths: if True, also return a dict from each edge to the
+       length of the shared boundary
+       :param scale: the scale of the mesh of cells for filing sides. By
+       default, cells are a bit taller than the median side is long.
+       :returns: a set of ints (vertex) and frozensets of two ints (edges),
+       and the dict of lengths if `lengths`
+       """
+    import numpy as np
+    from topology import Topology
+    
+    graph = set(range(len(shapes)))
+    topology = Topology.from_polygons(shapes, tolerance)
+    p = topology.vertices[topology.starts]
+    q = topology.vertices[topology.ends]
+    owners = topology.owners[topology.rings]
+    del topology
+    
+    s, t = _near_sides(p, q, owners, tolerance, scale)
+    shared = np.minimum(_overlap(p[s], q[s], p[t], q[t], tolerance),
+                        _overlap(p[t], q[t], p[s], q[s], tolerance))
+    
+    #total the shared lengths of each pair of shapes
+    u, v = owners[s], owners[t]
+    pairs, which = np.unique((np.minimum(u, v) << 32) | np.maximum(u, v),
+                             return_inverse=True)
+    totals = np.bincount(which, weights=shared, minlength=len(pairs))
+    keep = totals >= min_length
+    edges = map(frozenset, zip((pairs[keep] >> 32).tolist(),
+                               (pairs[keep] & 0xFFFFFFFF).tolist()))
+    if not lengths:
+        graph.update(edges)
+        return graph
+    shared_lengths = dict(zip(edges, totals[keep].tolist()))
+    graph.update(shared_lengths)
+    return graph, shared_lengths
+
+def _near_sides(p, q, owners, tolerance, scale=None):
+    """Return the pairs of sides of different owners that come within
+       `tolerance` of each other.
+
+       :param p: (M, 2) float64 array of the first points of the sides
+       :param q: (M, 2) float64 array of the second points of the sides
+       :param owners: int64 array of the owner of each side
+       :param scale: the scale of the mesh of cells to file the sides in
+       :returns: two int64 arrays of side numbers, each pair once, with the
+       lesser side number first
+       """
+    import math
+    import numpy as np
+    import spindex
+    
+    empty = np.zeros(0, dtype=np.int64)
+    if not len(p):
+        return empty, empty
+    if scale is None:
+        size = float(np.median(np.abs(q - p).max(axis=1))) + 2 * tolerance
+        scale = math.floor(math.log2(180 / size)) if size > 0 else 0
+        scale = min(max(scale, 0), spindex.MAX_KEY_SCALE)
+    width, height = spindex._Cell.dims(scale)
+    
+    #The cells each side passes within `tolerance` of (in each coordinate):
+    #like `spindex._walk_line_segment`, step through the columns of cells
+    #the widened side spans, and in each column take the rows spanned by the
+    #part of the side within `tolerance` of that column. A long side is filed
+    #in a number of cells proportional to its length, not to the area of its
+    #bounding box.
+    x_lo = np.minimum(p[:, 0], q[:, 0])
+    x_hi = np.maximum(p[:, 0], q[:, 0])
+    x0 = np.floor_divide(x_lo - tolerance, width).astype(np.int64)
+    nx = np.floor_divide(x_hi + tolerance, width).astype(np.int64) - x0 + 1
+    sides, k = _ranks(nx)
+    columns = x0[sides] + k
+    a = np.maximum(columns * width - tolerance, x_lo[sides])
+    b = np.minimum((columns + 1) * width + tolerance, x_hi[sides])
+    px, py = p[sides, 0], p[sides, 1]
+    dx, dy = q[sides, 0] - px, q[sides, 1] - py
+    upright = dx == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = dy / dx
+        ya = np.where(upright, py, py + (a - px) * slope)
+        yb = np.where(upright, py + dy, py + (b - px) * slope)
+    del a, b, px, py, dx, dy, upright, slope
+    
+    #a hair more than `tolerance`, for rounding in the interpolated ends
+    pad = tolerance + height * 1e-9
+    y0 = np.floor_divide(np.minimum(ya, yb) - pad, height).astype(np.int64)
+    ny = (np.floor_divide(np.maximum(ya, yb) + pad, height).astype(np.int64)
+          - y0 + 1)
+    del ya, yb
+    spans, k = _ranks(ny)
+    sides = sides[spans]
+    cells = spindex.cell_key(columns[spans], y0[spans] + k, scale)
+    del columns, spans, k
+    order = np.lexsort((owners[sides], cells))
+    cells, sides = cells[order], sides[order]
+    
+    #Each cell's sides are now in runs of the same owner, so each side pairs
+    #with the sides from the end of its owner's run to the end of its cell's
+    #run: only pairs of different owners are ever made.
+    new_cell = cells[1:] != cells[:-1]
+    new_owner = new_cell | (owners[sides[1:]] != owners[sides[:-1]])
+    cell_ends = _run_ends(new_cell)
+    owner_ends = _run_ends(new_owner)
+    counts = cell_ends - owner_ends
+    total = int(counts.sum())
+    if not total:
+        return empty, empty
+    a = np.repeat(np.arange(len(sides)), counts)
+    b = (np.repeat(owner_ends, counts) + np.arange(total) -
+         np.repeat(np.cumsum(counts) - counts, counts))
+    a, b = sides[a], sides[b]
+    pairs = np.unique((np.minimum(a, b) << 32) | np.maximum(a, b))
+    s, t = pairs >> 32, pairs & 0xFFFFFFFF
+    
+    near = _side_distances(p[s], q[s], p[t], q[t]) <= tolerance
+    return s[near], t[near]
+
+def _ranks(counts):
+    """Return, for a run of `counts[i]` entries for each `i`, the `i` and
+       the rank (from 0 to `counts[i] - 1`) of every entry."""
+    import numpy as np
+    owners = np.repeat(np.arange(len(counts)), counts)
+    return owners, np.arange(len(owners)) - (np.cumsum(counts) -
+                                             counts)[owners]
+
+def _run_ends(new):
+    """Return, for each entry of a sorted array, the index just past the end
+       of its run of equal entries.
+
+       :param new: bool array, True where entry `i + 1` starts a new run
+       """
+    import numpy as np
+    bounds = np.flatnonzero(np.concatenate(([True], new, [True])))
+    return np.repeat(bounds[1:], np.diff(bounds))
+
+def _side_distances(a, b, c, d):
+    """Return the distance between each side from `a` to `b` and the
+       corresponding side from `c` to `d` (all (M, 2) arrays)."""
+    import numpy as np
+    
+    def cross(o, e, f):
+        return ((e[:, 0] - o[:, 0]) * (f[:, 1] - o[:, 1]) -
+                (e[:, 1] - o[:, 1]) * (f[:, 0] - o[:, 0]))
+    
+    def to_side(point, e, f):
+        ef = f - e
+        t = ((point - e) * ef).sum(axis=1) / (ef * ef).sum(axis=1)
+        nearest = e + np.clip(t, 0, 1)[:, None] * ef
+        return np.hypot(*(point - nearest).T)
+    
+    crossing = ((np.sign(cross(a, b, c)) * np.sign(cross(a, b, d)) < 0) &
+                (np.sign(cross(c, d, a)) * np.sign(cross(c, d, b)) < 0))
+    distances = np.minimum(np.minimum(to_side(a, c, d), to_side(b, c, d)),
+                           np.minimum(to_side(c, a, b), to_side(d, a, b)))
+    distances[crossing] = 0
+    return distances
+
+def _overlap(p, q, a, b, tolerance):
+    """Return the length along each side from `a` to `b` of the part of
+       the corresponding side from `p` to `q` that lies within `tolerance`
+       of it (all (M, 2) arrays).
+
+       The side from `p` to `q` is followed from `p` (at 0) to `q` (at 1),
+       and the part kept is where it is within `tolerance` of the line
+       through `a` and `b` and projects onto the side between them."""
+    import numpy as np
+    ab = b - a
+    length = np.hypot(*ab.T)
+    unit = ab / length[:, None]
+    normal = np.column_stack((-unit[:, 1], unit[:, 0]))
+    
+    #positions along and distances from the line through `a` and `b`
+    along_p = ((p - a) * unit).sum(axis=1)
+    along_q = ((q - a) * unit).sum(axis=1)
+    off_p = ((p - a) * normal).sum(axis=1)
+    off_q = ((q - a) * normal).sum(axis=1)
+    
+    start, stop = np.zeros(len(p)), np.ones(len(p))
+    for lo, hi, at_p, at_q in ((-tolerance, tolerance, off_p, off_q),
+                               (0, length, along_p, along_q)):
+        change = at_q - at_p
+        flat = change == 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f1, f2 = (lo - at_p) / change, (hi - at_p) / change
+        enter = np.where(flat, np.where((lo <= at_p) & (at_p <= hi),
+                                        -np.inf, np.inf),
+                         np.minimum(f1, f2))
+        leave = np.where(flat, np.inf, np.maximum(f1, f2))
+        start, stop = np.maximum(start, enter), np.minimum(stop, leave)
+    return np.maximum(stop - start, 0) * np.abs(along_q - along_p)
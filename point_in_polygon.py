@@ -16,6 +16,8 @@ class BBox:
     """A class to model the bounding box of a collection of points in 2D
        space."""
 
+    __slots__ = ('x', 'y', 'X', 'Y')
+
     ADD_IDENT = None
 
     def __init__(self, x, X, y, Y, illegal=False):
@@ -62,9 +64,25 @@ class BBox:
         return iter([self.x, self.X, self.y, self.Y])
 BBox.ADD_IDENT = BBox(_MAX, _MIN, _MAX, _MIN, illegal=True)
 
+#Rings with at least this many vertices test single points with NumPy
+_VECTOR_MIN_VERTICES = 32
+
+#Most (points x sides) pairs to compare at once in `_Ring.classify`
+_VECTOR_BLOCK = 2**20
+
+#Rings with at least this many vertices are prepared when first tested
+_PREPARE_MIN_VERTICES = 1024
+
 class _Ring(list):
     """A class to represent an inner or outer boundary of a Polygon and to
-       maintain a reference to that boundary's bounding box."""
+       maintain a reference to that boundary's bounding box.
+
+       Besides the pure-python winding-number test of `in`, a ring can test
+       many points at once with a vectorized crossing-number test
+       (`contains_points`), using its vertices as a NumPy array (`array`).
+       """
+    
+    __slots__ = ('area', 'bbox', '_array', '_slabs')
     
     def __init__(self, points):
         assert all(points[0][i] == points[-1][i] for i in range(2)), (
@@ -95,18 +113,175 @@ class _Ring(list):
             e.y = min(y, e.y)
             e.Y = max(y, e.Y)
         self.bbox = e
+        self._array = None
+        self._slabs = None
     
     def __bool__(self):
         return True
     
     def __contains__(self, point):
-        return point in self.bbox and -4 == _winding(point, self)
+        if point not in self.bbox:
+            return False
+        if len(self) < _VECTOR_MIN_VERTICES:
+            return -4 == _winding(point, self)
+        import numpy as np
+        inside, boundary = self.classify(np.array([[point[0], point[1]]],
+                                                  dtype=np.float64))
+        if boundary[0]:
+            raise BoundaryException()
+        return bool(inside[0])
     
     def contains(self, point, edge_okay=False):
         try:
             return point in self
         except BoundaryException:
             return edge_okay
+    
+    @property
+    def array(self):
+        """The vertices of this ring as an (N, 2) float64 NumPy array."""
+        if self._array is None:
+            import numpy as np
+            self._array = np.array([point[:2] for point in self],
+                                   dtype=np.float64).reshape(-1, 2)
+        return self._array
+    
+    def classify(self, points):
+        """Test many points against this ring at once.
+
+           A point is on the boundary if it's within `_ERR_RAD_DEG` of a
+           vertex or exactly on a side, which is when `in` raises
+           BoundaryException. Otherwise it's inside if a ray from it crosses
+           the ring an odd number of times.
+
+           If the ring is prepared (see `prepare`), each point is only
+           tested against the sides near its latitude.
+
+           :param points: an (M, 2) float64 array
+           :returns: a bool array of which points are inside (and not on
+           the boundary) and a bool array of which are on the boundary
+           """
+        import numpy as np
+        inside = np.zeros(len(points), dtype=bool)
+        boundary = np.zeros(len(points), dtype=bool)
+        e = self.bbox
+        px, py = points[:, 0], points[:, 1]
+        todo = np.flatnonzero((e.x <= px) & (px <= e.X) &
+                              (e.y <= py) & (py <= e.Y))
+        if not len(todo):
+            return inside, boundary
+        
+        if self._slabs is None and len(self) >= _PREPARE_MIN_VERTICES:
+            self.prepare()
+        v = self.array
+        sides = (v[:-1, 0], v[:-1, 1], v[1:, 0], v[1:, 1])
+        if self._slabs is None:
+            block = max(1, _VECTOR_BLOCK // len(v))
+            for start in range(0, len(todo), block):
+                rows = todo[start:start + block]
+                inside[rows], boundary[rows] = _classify_block(
+                        points[rows], *sides)
+            return inside, boundary
+        
+        #group the points by slab and test each group against the sides
+        #that reach into its slab
+        y0, height, offsets, side_ids = self._slabs
+        slab = np.clip(((py[todo] - y0) // height).astype(np.int64),
+                       0, len(offsets) - 2)
+        order = np.argsort(slab, kind='stable')
+        todo, slab = todo[order], slab[order]
+        slabs, starts = np.unique(slab, return_index=True)
+        starts = np.append(starts, len(todo))
+        for j, k in enumerate(slabs.tolist()):
+            rows = todo[starts[j]:starts[j+1]]
+            near = side_ids[offsets[k]:offsets[k+1]]
+            if not len(near):
+                continue
+            inside[rows], boundary[rows] = _classify_block(
+                    points[rows], *(coords[near] for coords in sides))
+        return inside, boundary
+    
+    def prepare(self):
+        """Index the sides of this ring by latitude to speed up tests.
+
+           Split the ring's bbox into horizontal slabs, about one per four
+           sides, and list for each slab the sides whose latitudes (widened
+           by `_ERR_RAD_DEG`) reach into it. A point can only cross or touch
+           the sides of its own slab, so testing it costs time proportional
+           to the sides near it rather than to all the ring's sides.
+
+           Rings of `_PREPARE_MIN_VERTICES` or more vertices are prepared
+           automatically the first time they're tested.
+
+           :returns: None
+           """
+        import numpy as np
+        v = self.array
+        y_lo = np.minimum(v[:-1, 1], v[1:, 1]) - _ERR_RAD_DEG
+        y_hi = np.maximum(v[:-1, 1], v[1:, 1]) + _ERR_RAD_DEG
+        count = max(1, (len(v) - 1) // 4)
+        y0 = self.bbox.y
+        height = (self.bbox.Y - y0) / count or 1.0
+        lo = np.clip(((y_lo - y0) // height).astype(np.int64), 0, count - 1)
+        hi = np.clip(((y_hi - y0) // height).astype(np.int64), 0, count - 1)
+        
+        #one entry per (side, slab) pair, sorted by slab
+        spans = hi - lo + 1
+        side_ids = np.repeat(np.arange(len(v) - 1), spans)
+        slabs = np.repeat(lo - np.cumsum(spans) + spans, spans
+                          ) + np.arange(spans.sum())
+        order = np.argsort(slabs, kind='stable')
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(slabs, minlength=count), out=offsets[1:])
+        self._slabs = (y0, height, offsets, side_ids[order])
+    
+    def contains_points(self, points, edge_okay=False):
+        """Return a NumPy bool array of whether each of `points` is in this
+           ring, with `edge_okay` for points on its boundary.
+
+           :param points: a sequence of points or an (M, 2+) array
+           """
+        points = _as_point_array(points)
+        inside, boundary = self.classify(points)
+        inside[boundary] = edge_okay
+        return inside
+
+def _classify_block(points, xa, ya, xb, yb):
+    """Test `points` against the sides from (`xa`, `ya`) to (`xb`, `yb`) as
+       in `_Ring.classify`, all at once.
+
+       :returns: bool arrays of which points are inside and which are on the
+       boundary
+       """
+    import numpy as np
+    x = points[:, 0:1]
+    y = points[:, 1:2]
+    dx, dy = xb - xa, yb - ya
+    
+    near = ((((xa - x) ** 2 + (ya - y) ** 2) < _ERR_RAD_DEG_SQ) |
+            (((xb - x) ** 2 + (yb - y) ** 2) < _ERR_RAD_DEG_SQ)).any(axis=1)
+    cross = dx * (y - ya) - dy * (x - xa)
+    on_side = ((cross == 0) &
+               (np.minimum(xa, xb) <= x) & (x <= np.maximum(xa, xb)) &
+               (np.minimum(ya, yb) <= y) & (y <= np.maximum(ya, yb))
+               ).any(axis=1)
+    
+    #sides straddling the point's y, crossed east of the point
+    straddle = (ya > y) != (yb > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = xa + (y - ya) * dx / dy
+    crossings = (straddle & (x < x_cross)).sum(axis=1)
+    
+    edge = near | on_side
+    return (crossings % 2 == 1) & ~edge, edge
+
+def _as_point_array(points):
+    """Return `points` as an (M, 2) float64 NumPy array."""
+    import numpy as np
+    if not len(points):
+        return np.zeros((0, 2), dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+    return points[:, :2]
 
 def _turning_sign(point, v1, v2):
     #cross-product
@@ -154,16 +329,15 @@ def _turning(point, v1, v2):
     o1 = _orient(point, v1).value
     o2 = _orient(point, v2).value
     
-    #call early in case it raises BoundaryException
-    sign = _turning_sign(point, v1, v2) 
-    
     angle = o2 - o1
     if angle < -2:
         angle += 4
     elif angle > 2:
         angle -= 4
     elif abs(angle) == 2:
-        angle = 2 * sign
+        #v1 and v2 are in opposite quadrants, so if the side is collinear
+        #with `point`, `point` is on it, and this raises BoundaryException
+        angle = 2 * _turning_sign(point, v1, v2)
     return angle
 
 def _winding(point, ring):
@@ -194,6 +368,36 @@ def _SORT_BY_AREA_VERTS(ring):
     except ZeroDivisionError:
         return _MAX
 
+#Polygons with at least this many outer bounds index their bboxes to assign
+#inner bounds to outer ones
+_BBOX_INDEX_MIN_OUTERS = 16
+
+class _BBoxIndex:
+    """A sorted-interval index of the bboxes of some rings.
+
+       The bboxes are sorted by their least x, so the ones that might
+       contain a point are a prefix of that order found by binary search,
+       and that prefix is checked against the rest of the point's
+       coordinates all at once."""
+    
+    def __init__(self, rings):
+        import numpy as np
+        boxes = np.array([list(ring.bbox) for ring in rings],
+                         dtype=np.float64).reshape(-1, 4)
+        order = np.argsort(boxes[:, 0], kind='stable')
+        self.ids = order
+        self.x, self.X, self.y, self.Y = boxes[order].T
+    
+    def candidates(self, point):
+        """Return the sorted indices of the rings whose bboxes contain
+           `point`."""
+        import numpy as np
+        px, py = point[0], point[1]
+        n = np.searchsorted(self.x, px, side='right')
+        hits = ((px <= self.X[:n]) &
+                (self.y[:n] <= py) & (py <= self.Y[:n]))
+        return np.sort(self.ids[:n][hits]).tolist()
+
 class Polygon:
     """A polygon for GIS, with >=1 outer bounds and >=0 inner bounds."""
     
@@ -222,12 +426,18 @@ class Polygon:
         self.outers.sort(key=_SORT_BY_AREA_VERTS)
         self._out_to_in = {i:[] for i in range(len(self.outers))}
         if self.inners:
+            boxes = (_BBoxIndex(self.outers)
+                     if len(self.outers) >= _BBOX_INDEX_MIN_OUTERS
+                     else None)
             unassigned_inners = list(self.inners)
             while unassigned_inners:
                 assign_me = unassigned_inners.pop()
                 point = assign_me[0]
+                candidates = (range(len(self.outers))
+                              if boxes is None
+                              else boxes.candidates(point))
                 containers = [i
-                              for i in range(len(self.outers))
+                              for i in candidates
                               if self.outers[i].contains(point,
                                                          edge_okay=True)]
                 container = min(containers,
@@ -262,6 +472,59 @@ class Polygon:
         except BoundaryException: # `point` sits on an outer or inner bound
             return self.edge_okay
     
+    def compact(self):
+        """Return a `CompactPolygon` equivalent to this one."""
+        return CompactPolygon.from_polygon(self)
+    
+    def prepare(self):
+        """Index the sides of every boundary by latitude so that each test
+           of a point only looks at the sides near it (see `_Ring.prepare`).
+
+           Boundaries with `_PREPARE_MIN_VERTICES` or more vertices are
+           prepared automatically when first used.
+
+           :returns: this Polygon
+           """
+        for ring in self._rings:
+            ring.prepare()
+        return self
+    
+    def contains_points(self, points):
+        """Return a NumPy bool array of whether each of `points` is in this
+           Polygon, with `self.edge_okay` for points on a boundary.
+
+           :param points: a sequence of points or an (N, 2+) array
+           """
+        import numpy as np
+        points = _as_point_array(points)
+        result = np.zeros(len(points), dtype=bool)
+        
+        #as in `__contains__`, a point belongs to the first outer boundary
+        #that contains it or has it on its boundary, and then to the first
+        #inner boundary of that outer that does
+        outers = [outer.classify(points) for outer in self.outers]
+        hit = np.array([inside | edge for inside, edge in outers]
+                       ).reshape(len(outers), len(points))
+        first = hit.argmax(axis=0)
+        for i, (inside, edge) in enumerate(outers):
+            rows = np.flatnonzero(hit[i] & (first == i))
+            if not len(rows):
+                continue
+            result[rows[edge[rows]]] = self.edge_okay
+            rows = rows[inside[rows]]
+            inners = [inner.classify(points[rows])
+                      for inner in self._out_to_in[i]]
+            in_polygon = np.ones(len(rows), dtype=bool)
+            decided = np.zeros(len(rows), dtype=bool)
+            for inner_inside, inner_edge in inners:
+                new_edge = inner_edge & ~decided
+                in_polygon[new_edge] = self.edge_okay
+                new_inside = inner_inside & ~decided
+                in_polygon[new_inside] = False
+                decided |= new_edge | new_inside
+            result[rows] = in_polygon
+        return result
+    
     def __hash__(self):
         if self.__hash is None:
             self.__hash = hash((tuple(tuple(tuple(point)
@@ -317,22 +580,42 @@ class Polygon:
                             soup=soup).string = kml.coords_to_text(inner)
             return result
     
-    def spatial_index(self, scale):
+    def spatial_index(self, scale, keys=False, classify=False):
+        """Return the set of spindex cells this polygon intersects.
+
+           :param keys: if True, return int keys from `spindex.cell_key`
+           instead of cells
+           :param classify: if True, return two disjoint sets instead: the
+           cells entirely inside this polygon, and the cells its boundaries
+           cross"""
         import spindex
+        if keys:
+            get_cells_1d, get_cells_2d = (spindex.get_keys_1d,
+                                          spindex.get_keys_2d)
+        else:
+            get_cells_1d, get_cells_2d = (spindex.get_cells_1d,
+                                          spindex.get_cells_2d)
         
         cells = set()
-        for outer in self.outers:
-            cells.update(spindex.get_cells_2d(outer, scale=scale))
-        rims = [spindex.get_cells_1d(inner, scale=scale)
+        outer_rims = [get_cells_1d(outer, scale=scale)
+                      for outer in self.outers]
+        for i, outer in enumerate(self.outers):
+            cells.update(get_cells_2d(outer,
+                                      scale=scale,
+                                      boundary_cells=outer_rims[i]))
+        rims = [get_cells_1d(inner, scale=scale)
                 for inner in self.inners]
-        guts = [spindex.get_cells_2d(inner,
-                                     scale=scale,
-                                     boundary_cells=rims[i])
+        guts = [get_cells_2d(inner,
+                             scale=scale,
+                             boundary_cells=rims[i])
                 for i, inner in enumerate(self.inners)]
         for gut in guts:
             cells -= gut
         for rim in rims:
             cells.update(rim)
+        if classify:
+            edge = set().union(*outer_rims, *rims)
+            return cells - edge, edge
         return cells
     
     @property
@@ -423,23 +706,278 @@ class Polygon:
     def from_kml(placemark, info=None, edge_okay=False):
         """Convert a KML Placemark into a Polygon.
 
-           :param placemark: a <Placemark> tag from a KML document
+           :param placemark: a <Placemark> tag from a KML document (bs4 or
+           lxml.etree)
            :param info: passed to __init__
            :param edge_okay: passed to __init__"""
         
         import kml, itertools
-        geo = placemark.MultiGeometry or placemark.Polygon
+        from kml.etree import find, find_all
+        geo = find(placemark, 'MultiGeometry')
         if geo is None:
-            print(placemark)
-        outers = [kml.coords_from_tag(obi.coordinates)
-                  for obi in geo('outerBoundaryIs')]
+            geo = find(placemark, 'Polygon')
+        if geo is None:
+            raise ValueError('Placemark has no Polygon or MultiGeometry')
+        outers = [kml.coords_from_tag(find(obi, 'coordinates'))
+                  for obi in find_all(geo, 'outerBoundaryIs')]
         
         #The KML spec indicates that there is only one LinearRing per
         #innerBoundaryIs, but KMLs generated by Google Earth from shapefiles
         #may put (and render) multiple LinearRings in a single innerBoundaryIs
         inners = [kml.coords_from_tag(coordinates_tag)
                   for coordinates_tag in itertools.chain.from_iterable(
-                          ibi('coordinates')
-                          for ibi in geo('innerBoundaryIs'))]
+                          find_all(ibi, 'coordinates')
+                          for ibi in find_all(geo, 'innerBoundaryIs'))]
         
         return Polygon(outers, inners, info=info, edge_okay=edge_okay)
+
+class _RingView:
+    """A boundary of a `CompactPolygon`: a read-only view of a run of rows
+       of the polygon's vertex array that acts like a `_Ring`."""
+    
+    __slots__ = ('array', 'bbox', '_slabs')
+    
+    def __init__(self, array):
+        """:param array: an (N, 2) float64 NumPy array of vertices"""
+        self.array = array
+        x, y = array.min(axis=0).tolist()
+        X, Y = array.max(axis=0).tolist()
+        self.bbox = BBox(x, X, y, Y)
+        self._slabs = None
+    
+    def __len__(self):
+        return len(self.array)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(map(tuple, self.array[i].tolist()))
+        return tuple(self.array[i].tolist())
+    
+    def __iter__(self):
+        return iter(list(map(tuple, self.array.tolist())))
+    
+    def __reversed__(self):
+        return iter(list(map(tuple, self.array[::-1].tolist())))
+    
+    @property
+    def area(self):
+        x, y = self.array[:, 0], self.array[:, 1]
+        return abs(float((x[:-1] * y[1:] - x[1:] * y[:-1]).sum())) / 2
+    
+    __bool__ = _Ring.__bool__
+    __contains__ = _Ring.__contains__
+    contains = _Ring.contains
+    classify = _Ring.classify
+    prepare = _Ring.prepare
+    contains_points = _Ring.contains_points
+
+class CompactPolygon:
+    """A Polygon stored in one contiguous float64 array of vertices.
+
+       A `Polygon` keeps each vertex as a tuple of floats in a list, which
+       costs over 100 bytes per vertex. This keeps them as rows of a single
+       (N, 2) NumPy array (16 bytes per vertex) with an array of the offsets
+       where each boundary starts, and makes `_Ring`-like views of the
+       boundaries only when they're asked for.
+
+       It has the same API as `Polygon` (`outers`, `inners`, `sides`,
+       `vertices`, `bbox`, `in`, `contains_points`, `spatial_index`,
+       `prepare`, ...) and tests points the same way."""
+    
+    __slots__ = ('coords', 'offsets', 'holes', 'info', 'edge_okay',
+                 '_views')
+    
+    def __init__(self, outers, inners=None, info=None, edge_okay=False):
+        """Make a CompactPolygon; the parameters are those of `Polygon`."""
+        polygon = Polygon(outers, inners)
+        self._pack(polygon)
+        self.info = info
+        self.edge_okay = edge_okay
+    
+    @staticmethod
+    def from_polygon(polygon):
+        """Return a CompactPolygon with the boundaries, `info`, and
+           `edge_okay` of `polygon`."""
+        result = CompactPolygon.__new__(CompactPolygon)
+        result._pack(polygon)
+        result.info = polygon.info
+        result.edge_okay = polygon.edge_okay
+        return result
+    
+    @staticmethod
+    def from_arrays(coords, offsets, holes, info=None, edge_okay=False):
+        """Make a CompactPolygon straight from its arrays, as laid out by
+           `_pack`, without copying them.
+
+           :param coords: an (N, 2) float64 array of the vertices of all the
+           boundaries, outers first, each boundary oriented as a `_Ring`
+           orients it
+           :param offsets: an int64 array of where each boundary starts in
+           `coords`, plus `len(coords)`
+           :param holes: an int64 array of the index of the outer that each
+           inner (after the outers, in order) is in
+           """
+        result = CompactPolygon.__new__(CompactPolygon)
+        result.coords = coords
+        result.offsets = offsets
+        result.holes = holes
+        result.info = info
+        result.edge_okay = edge_okay
+        result._views = None
+        return result
+    
+    def _pack(self, polygon):
+        """Copy the boundaries of `polygon` into this one's arrays: the
+           outers first, in order, and then the inners of each outer."""
+        import numpy as np
+        rings = list(polygon.outers)
+        holes = []
+        for i in range(len(polygon.outers)):
+            for inner in polygon._out_to_in[i]:
+                rings.append(inner)
+                holes.append(i)
+        self.coords = np.array([point[:2]
+                                for ring in rings
+                                for point in ring],
+                               dtype=np.float64).reshape(-1, 2)
+        self.offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum([len(ring) for ring in rings], out=self.offsets[1:])
+        self.holes = np.array(holes, dtype=np.int64)
+        self._views = None
+    
+    def _rings_views(self):
+        """Return the outer views, the inner views, and the map from each
+           outer's index to its inner views, making them if needed."""
+        if self._views is None:
+            offsets = self.offsets.tolist()
+            views = [_RingView(self.coords[offsets[i]:offsets[i+1]])
+                     for i in range(len(offsets) - 1)]
+            count = len(views) - len(self.holes)
+            outers, inners = views[:count], views[count:]
+            out_to_in = {i:[] for i in range(count)}
+            for i, inner in zip(self.holes.tolist(), inners):
+                out_to_in[i].append(inner)
+            self._views = (outers, inners, out_to_in)
+        return self._views
+    
+    @property
+    def outers(self):
+        return self._rings_views()[0]
+    
+    @property
+    def inners(self):
+        return self._rings_views()[1]
+    
+    @property
+    def _out_to_in(self):
+        return self._rings_views()[2]
+    
+    @property
+    def bbox(self):
+        """The least and greatest x and y coordinates of the vertices."""
+        x, y = self.coords.min(axis=0).tolist()
+        X, Y = self.coords.max(axis=0).tolist()
+        return BBox(x, X, y, Y)
+    
+    @property
+    def nbytes(self):
+        """The number of bytes in this polygon's arrays."""
+        return self.coords.nbytes + self.offsets.nbytes + self.holes.nbytes
+    
+    __contains__ = Polygon.__contains__
+    contains_points = Polygon.contains_points
+    prepare = Polygon.prepare
+    to_kml = Polygon.to_kml
+    spatial_index = Polygon.spatial_index
+    _rings = Polygon._rings
+    stokesable = Polygon.stokesable
+    vertices = Polygon.vertices
+    sides = Polygon.sides
+    
+    @staticmethod
+    def from_shape(shape, info=None, edge_okay=False):
+        """Convert a shapefile.Shape into a CompactPolygon (see
+           `Polygon.from_shape`)."""
+        return CompactPolygon.from_polygon(
+                Polygon.from_shape(shape, info=info, edge_okay=edge_okay))
+    
+    @staticmethod
+    def from_kml(placemark, info=None, edge_okay=False):
+        """Convert a KML Placemark into a CompactPolygon (see
+           `Polygon.from_kml`)."""
+        return CompactPolygon.from_polygon(
+                Polygon.from_kml(placemark, info=info, edge_okay=edge_okay))
+
+UNMATCHED = -1
+AMBIGUOUS = -2
+
+def join(points, polygons, scale=16):
+    """Find which of the `polygons` each of the `points` is in.
+
+       Index the polygons by spindex cell, keeping apart the cells a polygon
+       covers and the cells its boundary crosses, and group the points by
+       the cell they're in. Each point in a covered cell is matched to the
+       polygon with no test at all, and each polygon whose boundary crosses
+       some points' cells is tested against all those points at once.
+
+       :param points: a sequence of points or an (N, 2+) array
+       :param polygons: a list of Polygons (see `Polygon.from_kml` and
+       `Polygon.from_shape`)
+       :param scale: the scale of the spindex cells; finer cells mean fewer
+       points to test against each polygon but a bigger index
+       :returns: an int64 array with, for each point, the index into
+       `polygons` of the polygon containing it, `UNMATCHED` (-1) if no polygon
+       contains it, or `AMBIGUOUS` (-2) if more than one does; and a dict
+       from the index of each ambiguous point to a sorted list of the
+       polygons containing it
+       """
+    import numpy as np
+    import spindex
+    
+    ids = np.full(len(points), UNMATCHED, dtype=np.int64)
+    ambiguous = {}
+    if not len(points):
+        return ids, ambiguous
+    points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+    
+    index = spindex.ClassifiedIndex()
+    for i, polygon in enumerate(polygons):
+        inside, edge = polygon.spatial_index(scale, keys=True, classify=True)
+        for key in inside:
+            index.add(key, i)
+        for key in edge:
+            index.add(key, i, True)
+    
+    #group the points by cell: the points of the `c`th distinct cell are
+    #order[starts[c]:starts[c+1]]
+    keys = spindex.get_keys(points, scale)
+    order = np.argsort(keys, kind='stable')
+    cell_keys, starts = np.unique(keys[order], return_index=True)
+    starts = np.append(starts, len(order))
+    
+    hits = []
+    tests = {}
+    for c, key in enumerate(cell_keys.tolist()):
+        inside, edge = index.classify(key)
+        if not inside and not edge:
+            continue
+        group = order[starts[c]:starts[c+1]]
+        for i in inside:
+            hits.append((group, i))
+        for i in edge:
+            tests.setdefault(i, []).append(group)
+    for i, groups in tests.items():
+        group = np.concatenate(groups)
+        hits.append((group[polygons[i].contains_points(points[group])], i))
+    
+    for group, i in hits:
+        fresh = ids[group] == UNMATCHED
+        ids[group[fresh]] = i
+        for p in group[~fresh].tolist():
+            if ids[p] != AMBIGUOUS:
+                ambiguous[p] = [int(ids[p])]
+                ids[p] = AMBIGUOUS
+            ambiguous[p].append(i)
+    for matches in ambiguous.values():
+        matches.sort()
+    return ids, ambiguous
@@ -2,7 +2,9 @@ _FLOAT = float
 
 def float(string, length):
     """Round the base-10 number spelled out by `string` to `length`-many digits
-       after the decimal point."""
+       after the decimal point.
+
+       With a `length` of 0, the result is an int string with no point."""
     
     #if `string` has no decimal tail at all, just kick back the original
     try:
@@ -36,12 +38,12 @@ def float(string, length):
         state = 1
     else:
         state = (-1
-                 if int(trunk[-1]) % 2 == 0
+                 if int((head + trunk)[-1:] or '0') % 2 == 0
                  else 1)
 
     #If rounding down, that's easy
     if state < 0:
-        return f'{head}.{trunk}'
+        return f'{head}.{trunk}' if length else head or '0'
     #otherwise, we're definitely rounding up
 
     #cram the int head and the trunk part of the decimal tail together,
@@ -50,6 +52,79 @@ def float(string, length):
     #convert back to string
     #split into two pieces for the int part and the decimal part
     #put the decimal point into the string between those two pieces and return
-    stuff = str(int(head + trunk) + 1)
+    #pad with zeros so that small numbers like 0.0000019 keep their int head
+    stuff = str(int(head + trunk or '0') + 1).zfill(length + 1)
+    if not length:
+        return stuff
     new_head, new_trunk = stuff[:-length], stuff[-length:]
     return f'{new_head}.{new_trunk}'
+
+#Rounding via binary floats is trusted unless the scaled value is this close
+#to a tie (plus a few ulps of the scaled value), where the float may not
+#match the decimal string
+_TIE_MARGIN = 1e-6
+_TIE_ULPS = 2.0 ** -50
+
+#Scaled values must stay well within the integers a float represents exactly
+_EXACT_LIMIT = 2 ** 52
+
+def floats(strings, length):
+    """Round many base-10 number strings to `length` digits after the point.
+
+       This is the batch counterpart of `float`, with the same results: ties
+       round to even, strings with no more than `length` decimal digits come
+       back unchanged, and rounded ones keep exactly `length` digits. The
+       rounding is done on whole NumPy arrays at once for plain decimals
+       like '-12.345'. Values so close to a tie that a binary float can't
+       settle it, and strings that aren't plain (a leading point, zero, or
+       plus sign, an exponent, ...), whose spelling `float` keeps or changes
+       depending on the rounding, are passed to `float` one at a time.
+
+       :param strings: a sequence (or NumPy array) of number strings
+       :param length: the number of digits to keep after the decimal point
+       :returns: a NumPy array of strings
+       """
+    import numpy as np
+    
+    strings = np.asarray(strings, dtype=str)
+    if not strings.size:
+        return strings
+    
+    #a plain decimal is an optional minus sign, an int part without extra
+    #leading zeros, and maybe a point and some digits
+    heads, points, tails = np.moveaxis(np.char.partition(strings, '.'), -1, 0)
+    signs = np.where(np.char.startswith(heads, '-'), '-', '')
+    bodies = np.char.lstrip(heads, '-')
+    plain = ((np.char.add(signs, bodies) == heads) &
+             np.char.isdigit(bodies) &
+             ((bodies == '0') | ~np.char.startswith(bodies, '0')) &
+             (np.char.isdigit(tails) | (tails == '')))
+    keep = (points == '') | (np.char.str_len(tails) <= length)
+    rows = plain & ~keep
+    
+    values = np.abs(strings[rows].astype(np.float64))
+    scaled = values * 10.0 ** length
+    if scaled.size and scaled.max() >= _EXACT_LIMIT:
+        return np.array([float(string, length) for string in strings.flat]
+                        ).reshape(strings.shape)
+    rounded = np.rint(scaled) #rint rounds ties to even
+    near_tie = (np.abs(scaled - np.floor(scaled) - 0.5) <
+                _TIE_MARGIN + scaled * _TIE_ULPS)
+    
+    #spell out the rounded numbers from their int parts and decimal parts
+    rounded = rounded.astype(np.int64)
+    ints, trunks = np.divmod(rounded, 10 ** length)
+    texts = np.char.add(signs[rows], ints.astype(str))
+    if length and texts.size:
+        texts = np.char.add(np.char.add(texts, '.'),
+                            np.char.zfill(trunks.astype(str), length))
+    
+    #`float` can add a 0 before a leading point
+    width = max(strings.dtype.itemsize, texts.dtype.itemsize) // 4 + 1
+    result = strings.astype(f'<U{width}')
+    result[rows] = texts
+    one_at_a_time = ~plain
+    one_at_a_time[rows] = near_tie
+    for i in zip(*np.nonzero(one_at_a_time)):
+        result[i] = float(str(strings[i]), length)
+    return result
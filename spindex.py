@@ -5,14 +5,27 @@ The name is a crude portmanteau of 'spatial index'.
 This script lets you map a point, line, or polygon onto the cell or cells that
 if intersects of a lat-long-aligned grid covering the earth, which, at each
 mesh scale, subdivides the cells of the scale lower by 1 into 4 quarters by
-cutting the east-west width and the north-south height in half."""
+cutting the east-west width and the north-south height in half.
 
-import geometry
+Each `get_cells_*` function has a `get_keys_*` twin that returns the same
+cells as plain ints (see `cell_key`) instead of `_Cell` objects. Keys are
+much smaller, need no interning, and can be stored and combined as sets of
+ints or as sorted NumPy int64 arrays (`numpy.union1d`, `numpy.setdiff1d`,
+etc.). `_Cell.from_key` turns a key back into a cell for display."""
+
+import contextlib
 import itertools
+import math
 from canon import Canon
 
 _SCALE = 16
 
+#The most cells `_Cell.get` keeps interned at once by default
+CELL_CACHE_CAPACITY = 2**20
+
+#Keys of cells at scales above this don't fit in an int64
+MAX_KEY_SCALE = 30
+
 def set_scale(scale):
     if not isinstance(scale, int):
         raise TypeError('scale must be an int')
@@ -88,6 +101,11 @@ class _BBox:
 def get_cells_2d(points, scale=None, boundary_cells=set()):
     """Return a set of the cells that intersect the polygon `points`.
 
+       The cells of the polygon's boundary come from `get_cells_1d` and the
+       cells of its interior come from `get_cell_ranges_2d`, so the memory
+       needed beyond the returned set itself is proportional to the boundary,
+       not to the polygon's bounding box.
+
        :param points: A list of points in the plane. The first point must be
        repeated as the last point
 
@@ -99,50 +117,199 @@ def get_cells_2d(points, scale=None, boundary_cells=set()):
        When spatially indexing polygons with many interior holes, use this to
        avoid recomputing the hole's boundary cells.
        """
-    from point_in_polygon import _Ring
-
     scale = scale or _SCALE
     
-    ring = _Ring(points)
     cells = boundary_cells.copy() or get_cells_1d(points, scale)
+    for y, x_start, x_stop in get_cell_ranges_2d(points, scale):
+        cells.update(_Cell.get(x, y, scale) for x in range(x_start, x_stop))
+    return cells
+
+def get_keys_2d(points, scale=None, boundary_cells=set()):
+    """Return a set of the keys of the cells that intersect the polygon
+       `points`.
+
+       This is `get_cells_2d` with cells as ints (see `cell_key`), so
+       `boundary_cells`, if specified, must be a set of keys, such as from
+       `get_keys_1d`.
+       """
+    scale = scale or _SCALE
+    
+    keys = boundary_cells.copy() or get_keys_1d(points, scale)
+    for y, x_start, x_stop in get_cell_ranges_2d(points, scale):
+        keys.update(cell_key(x, y, scale) for x in range(x_start, x_stop))
+    return keys
+
+def get_key_array_2d(points, scale=None, boundary_cells=None):
+    """Return a sorted NumPy int64 array of the keys of the cells that
+       intersect the polygon `points`.
+
+       The interior is encoded in bulk, one array operation for all its
+       cells, which makes this the fastest way to index a large polygon at a
+       fine scale.
+
+       :param boundary_cells: keys of the polygon's boundary cells (a set or
+       an array), used instead of calling `get_keys_1d`
+       """
+    import numpy as np
+    scale = scale or _SCALE
     
-    #Build a solid rectangle of all the cells of the bounding box of `points`
-    #not including the cells already assigned for return
-    min_x, max_x, min_y, max_y = sum(
-            (_BBox(x,x,y,y) for x,y in (cell.indices for cell in cells)),
-            _BBox(float('inf'), float('-inf'),
-                 float('inf'), float('-inf')))
-    unassigned = {(x,y)
-                  for x in range(min_x, max_x+1)
-                  for y in range(min_y, max_y+1)
-                  } - {tuple(cell.indices)
-                       for cell in cells}
-    
-    #while there are still unassigned cells, grab one and grow a connected
-    #component of cells around it, only growing it within the set of
-    #unassigned cells, then remove all those cells in that component from the
-    #unassigned set, then if that component is inside the ring made by
-    #`points`, add those cells for return
-    while unassigned:
-        cell = next(iter(unassigned))
-        news = {cell}
-        edge = set()
-        core = set()
-        while news:
-            edge, news = news, set()
-            for x,y in edge:
-                news.update([(x+1,y), (x-1,y), (x,y+1), (x,y-1)])
-            core |= edge
-            news -= core
-            news &= unassigned
-        unassigned -= core
-        if _Cell.get(cell[0], cell[1], scale).center in ring:
-            cells.update(_Cell.get(x,y,scale) for x,y in core)
+    if boundary_cells is None:
+        boundary_cells = get_keys_1d(points, scale)
+    if isinstance(boundary_cells, (set, frozenset)):
+        boundary_cells = np.fromiter(boundary_cells, dtype=np.int64,
+                                     count=len(boundary_cells))
+    xs, ys = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for y, x_start, x_stop in get_cell_ranges_2d(points, scale):
+        xs.append(np.arange(x_start, x_stop, dtype=np.int64))
+        ys.append(np.full(x_stop - x_start, y, dtype=np.int64))
+    interior = cell_key(np.concatenate(xs), np.concatenate(ys), scale)
+    return np.union1d(interior, boundary_cells)
+
+def get_cell_ranges_2d(points, scale=None):
+    """Yield the rows of cells whose centers are inside the polygon `points`.
+
+       This is a scanline (even-odd) fill: each side of the polygon is only
+       considered for the rows of cells whose center lines it crosses, where
+       the x coordinate of the crossing is computed. Sorting a row's crossings
+       and pairing them up gives the spans of that row inside the polygon.
+
+       Every cell that intersects the polygon either has its center inside
+       the polygon (and is covered by a range from here) or is crossed by the
+       polygon's boundary (and is found by `get_cells_1d`).
+
+       :param points: A list of points in the plane. The first point must be
+       repeated as the last point
+       :param scale: the exponential scale of the mesh
+       :returns: a generator of `(y, x_start, x_stop)` tuples, each meaning
+       that the cells `x_start` (inclusive) to `x_stop` (exclusive) of row
+       `y` have their centers inside the polygon
+       """
+    return get_ring_ranges_2d([points], scale)
+
+def get_ring_ranges_2d(rings, scale=None):
+    """Yield the rows of cells whose centers are inside an area bounded by
+       several rings, such as a polygon with holes or a MultiGeometry.
+
+       This is `get_cell_ranges_2d` with the crossings of all the `rings`
+       counted together, so by the even-odd rule a hole's cells are left out.
+
+       :param rings: a list of rings of points, each ending with its first
+       point
+       :param scale: the exponential scale of the mesh
+       :returns: a generator of `(y, x_start, x_stop)` tuples
+       """
+    scale = scale or _SCALE
+    width, height = _Cell.dims(scale)
+    
+    #the center line of row y is at latitude (y + 0.5) * height. A side
+    #crosses that line if the line is at or above its low end and below its
+    #high end, so a vertex is never counted twice
+    crossings = {}
+    for points in rings:
+        for i in range(1, len(points)):
+            (xa, ya), (xb, yb) = points[i-1][:2], points[i][:2]
+            if ya == yb:
+                continue
+            if ya > yb:
+                (xa, ya), (xb, yb) = (xb, yb), (xa, ya)
+            slope = (xb - xa) / (yb - ya)
+            for y in range(math.ceil(ya / height - 0.5),
+                           math.ceil(yb / height - 0.5)):
+                x = xa + ((y + 0.5) * height - ya) * slope
+                try:
+                    crossings[y].append(x)
+                except KeyError:
+                    crossings[y] = [x]
+    
+    for y in sorted(crossings):
+        xs = sorted(crossings.pop(y))
+        for i in range(1, len(xs), 2):
+            #cells whose centers (x + 0.5) * width are strictly between the
+            #two crossings
+            x_start = math.floor(xs[i-1] / width - 0.5) + 1
+            x_stop  = math.ceil( xs[i]   / width - 0.5)
+            if x_start < x_stop:
+                yield y, x_start, x_stop
+
+def _walk_line_segment(side, scale):
+    """Find cells intersecting `side` (at `scale`) by walking the grid.
+
+       Step through the columns of cells that the side spans, and in each
+       column take the rows spanned by the part of the side inside that
+       column. Only cells the side actually crosses are ever visited.
+
+       A side belongs to a cell if it passes through the cell's interior,
+       and a side lying exactly on a line of the grid belongs to the cells
+       north or east of that line. A side of zero length belongs to the cell
+       its point is in.
+
+       :returns: a set of `(x, y)` cell indices
+       """
+    (xa, ya), (xb, yb) = (point[:2] for point in side)
+    if xa > xb:
+        (xa, ya), (xb, yb) = (xb, yb), (xa, ya)
+    width, height = _Cell.dims(scale)
+    
+    if xa == xb and ya == yb:
+        return {tuple(get_cell((xa, ya), scale).indices)}
+    if ya == yb: #east-west, on or inside row y
+        y = int(ya // height)
+        return {(x, y) for x in _open_span(xa, xb, width)}
+    if xa == xb: #north-south, on or inside column x
+        x = int(xa // width)
+        return {(x, y) for y in _open_span(min(ya, yb), max(ya, yb), height)}
+    
+    #a side with both ends inside the same cell (not on its edges) is only
+    #in that cell
+    x, y = xa // width, ya // height
+    if (x == xb // width and y == yb // height and
+            xa != x * width and ya != y * height and
+            xb != x * width and yb != y * height):
+        return {(int(x), int(y))}
+
+    y_min, y_max = min(ya, yb), max(ya, yb)
+    slope = (yb - ya) / (xb - xa)
+    cells = set()
+    for x in _open_span(xa, xb, width):
+        #the part of the side inside column x
+        x_lo = max(xa, x * width)
+        x_hi = min(xb, (x + 1) * width)
+        y_lo = ya if x_lo == xa else ya + (x_lo - xa) * slope
+        y_hi = yb if x_hi == xb else ya + (x_hi - xa) * slope
+        if y_lo > y_hi:
+            y_lo, y_hi = y_hi, y_lo
+        rows = _open_span(y_lo, y_hi, height)
+        
+        #The rows between the first and last are certainly crossed. The
+        #interpolated ends may be off by rounding where the side passes
+        #(nearly) through a corner, so the rows at and just beyond them get
+        #an exact test of the signs of the cross products to their corners.
+        first, last = rows.start, rows.stop - 1
+        cells.update((x, y) for y in range(first+1, last))
+        west, east = x * width, (x + 1) * width
+        for y in {first - 1, first, last, last + 1}:
+            south, north = y * height, (y + 1) * height
+            #the cell's rows must overlap the side's (its columns do, by
+            #`_open_span`)
+            if (min(north, y_max) > max(south, y_min) and
+                    _crosses(xa, ya, xb, yb, west, east, south, north)):
+                cells.add((x, y))
     return cells
 
-def _passthru(cell, point_a, point_b):
-    signs = [geometry.cross_sign(point_a, point_b, point_c)
-             for point_c in cell.corners]
+def _crosses(xa, ya, xb, yb, west, east, south, north):
+    """Return True if the line through (`xa`, `ya`) and (`xb`, `yb`) passes
+       through the interior of the cell with edges `west`, `east`, `south`,
+       and `north`, or lies on its west or south edge.
+
+       The test is on the signs of the cross products of the line with the
+       vectors from (`xa`, `ya`) to the cell's corners (see
+       `geometry.cross_sign`), computed from the numbers, so no `_Cell` is
+       made."""
+    dx, dy = xb - xa, yb - ya
+    signs = []
+    for x, y in ((west, north), (east, north), (east, south), (west, south)):
+        z = dx * (y - ya) - dy * (x - xa)
+        signs.append(-1 if z < 0 else 1 if z > 0 else 0)
     if 1 in signs and -1 in signs:
         return True
     z = signs.count(0)
@@ -154,46 +321,10 @@ def _passthru(cell, point_a, point_b):
         return sw == 0 and (nw == 0 or se == 0)
     return False
 
-def _grow_cells_line_segment(side, scale):
-    """Find cells intersecting `side` (at `scale`) by linking neighbors.
-       
-       Begin growth from the cells containing the endpoints of `side`. Consider
-       the 8 cells around each of those cells, and use cross products of
-       a vector defined by `side` and a vector from one end of `side` to a
-       corner of a cell under consideration.
-
-       A cell under consideration intersects the line if the signs of the
-       four cross products for its corners include both positive and negative.
-       If the list of cross-product signs for the cell contains two zeroes,
-       then if one of them is the southwest corner and the other is either the
-       northwest corner or the southeast corner, then the line intersects the
-       cell."""
-    (xa,ya),(xb,yb) = a,b = side
-    cell_a, cell_b = (get_cell(point, scale) for point in side)
-    
-    box = _BBox(*(sorted([xa, xb]) + sorted([ya, yb])))
-    
-    news = {cell_a, cell_b}
-    edge, core = set(), set()
-    while news:
-        edge, news = news, set()
-        for cell in edge:
-            news.update(cell.neighbors)
-        core |= edge
-        news -= core
-        news = {cell
-                for cell in news
-                if (_passthru(cell, a, b) and
-                    box.dim == (_BBox(cell) & box).dim)}
-    
-    #Test the original seed cells, too
-    for cell in [cell_a, cell_b]:
-        if not (_passthru(cell, a, b) and
-                box.dim == (_BBox(cell) & box).dim):
-            core.remove(cell)
-
-    return _Cell._INTERN_CACHE.multi(core)
-    #return _Cell._cache_back(core)
+def _open_span(lo, hi, size):
+    """Return the range of cell indices whose open intervals (i * size,
+       (i + 1) * size) overlap the open interval (`lo`, `hi`)."""
+    return range(int(lo // size), int(-(-hi // size)))
 
 def get_cells_1d(points, scale=None):
     """Return a set of the cells that intersect the 1-D feature `points`.
@@ -201,15 +332,453 @@ def get_cells_1d(points, scale=None):
        :param points: A sequence of at least two points
        """
     scale = scale or _SCALE
-    
-    cells = set(itertools.chain.from_iterable(
-            _grow_cells_line_segment(side, scale)
+    return {_Cell.get(x, y, scale) for x, y in _indices_1d(points, scale)}
+
+def get_keys_1d(points, scale=None):
+    """Return a set of the keys of the cells that intersect the 1-D feature
+       `points`.
+       
+       :param points: A sequence of at least two points
+       """
+    scale = scale or _SCALE
+    return {cell_key(x, y, scale) for x, y in _indices_1d(points, scale)}
+
+def _indices_1d(points, scale):
+    """Return a set of the `(x, y)` indices of the cells that intersect the
+       1-D feature `points`."""
+    return set(itertools.chain.from_iterable(
+            _walk_line_segment(side, scale)
             for side in (points[i-1:i+1] for i in range(1, len(points)))))
-    
-    return cells
 
 get_cells_0d = get_cell
 
+def cell_cache_stats():
+    """Return the size, capacity, hits, misses, and evictions of the cache
+       of interned cells."""
+    return _Cell._INTERN_CACHE.stats()
+
+def clear_cell_cache():
+    """Forget all interned cells."""
+    _Cell._INTERN_CACHE.clear()
+
+@contextlib.contextmanager
+def cell_cache(capacity=CELL_CACHE_CAPACITY):
+    """Intern cells in a new cache for the duration of a `with` block.
+
+       When the block ends, the cache (and every cell only it refers to) is
+       dropped and the previous cache is restored, so a job that indexes
+       layer after layer can run each layer in its own block.
+
+       :param capacity: the most cells to keep at once, or None for no limit
+       :returns: the new `canon.Canon`, as the target of `with ... as`
+       """
+    previous = _Cell._INTERN_CACHE
+    _Cell._INTERN_CACHE = cache = Canon(capacity=capacity)
+    try:
+        yield cache
+    finally:
+        _Cell._INTERN_CACHE = previous
+
+def get_key(point, scale=None):
+    """Return the key of the cell containing `point`."""
+    scale = scale or _SCALE
+    x_index, y_index = (int(latlng//widhei)
+                        for latlng, widhei
+                        in zip(point, _Cell.dims(scale)))
+    return cell_key(x_index, y_index, scale)
+
+get_keys_0d = get_key
+
+def get_keys(points, scale=None):
+    """Return a NumPy int64 array of the keys of the cells containing each of
+       `points`.
+
+       :param points: a sequence of points or an (N, 2+) array
+       """
+    import numpy as np
+    scale = scale or _SCALE
+    if not len(points):
+        return np.zeros(0, dtype=np.int64)
+    points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+    width, height = _Cell.dims(scale)
+    x_index = np.floor_divide(points[:, 0], width ).astype(np.int64)
+    y_index = np.floor_divide(points[:, 1], height).astype(np.int64)
+    return cell_key(x_index, y_index, scale)
+
+def cell_key(x_index, y_index, scale):
+    """Encode the cell `x_index`, `y_index` at `scale` as a single int.
+
+       The key is a leading 1 bit followed by the bits of the (shifted) x and
+       y indices interleaved (Z-order, or Morton order), two bits per level
+       of scale. So the key of a cell's parent (the cell of scale `scale-1`
+       containing it) is the cell's key shifted right by 2 bits, the keys of
+       all the cells inside a cell start with that cell's key, and cells
+       near each other in space tend to have keys near each other.
+
+       The indices can also be NumPy int64 arrays, in which case an array of
+       keys is returned.
+
+       Raise ValueError if `scale` exceeds `MAX_KEY_SCALE` or the cell isn't
+       on the earth (longitude -360 to 360, latitude -180 to 180).
+       """
+    if not 0 <= scale <= MAX_KEY_SCALE:
+        raise ValueError(f'scale must be from 0 to {MAX_KEY_SCALE}')
+    offset = 1 << scale
+    u = x_index + offset
+    v = y_index + offset
+    outside = (u | v) >> (scale + 1)
+    if outside.any() if hasattr(outside, 'any') else outside:
+        raise ValueError('cell indices out of range for scale '
+                         + str(scale))
+    return (1 << 2 * (scale + 1)) | _spread(u) | (_spread(v) << 1)
+
+def key_indices(key, scale=None):
+    """Decode a key from `cell_key` into its x index, y index, and scale.
+
+       :param key: a cell key, or a NumPy int64 array of them
+       :param scale: the scale of the keys; required if `key` is an array
+       """
+    if scale is None:
+        scale = key_scale(key)
+    offset = 1 << scale
+    mask = (1 << 2 * (scale + 1)) - 1
+    key = key & mask
+    return (_compact(key) - offset, _compact(key >> 1) - offset, scale)
+
+def key_scale(key):
+    """Return the scale of the cell with key `key`."""
+    return (int(key).bit_length() - 1) // 2 - 1
+
+def key_children(key):
+    """Return the keys of the four cells one scale finer inside the cell
+       with key `key`."""
+    return range(key << 2, (key << 2) + 4)
+
+def key_parent(key, levels=1):
+    """Return the key of the cell `levels` scales coarser containing the cell
+       with key `key`."""
+    return key >> 2 * levels
+
+def _spread(v):
+    """Move bit i of the 32-bit int `v` to bit 2i."""
+    v = v & 0xFFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v <<  8)) & 0x00FF00FF00FF00FF
+    v = (v | (v <<  4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v <<  2)) & 0x3333333333333333
+    v = (v | (v <<  1)) & 0x5555555555555555
+    return v
+
+def _compact(v):
+    """Move bit 2i of `v` to bit i, undoing `_spread`."""
+    v = v & 0x5555555555555555
+    v = (v | (v >>  1)) & 0x3333333333333333
+    v = (v | (v >>  2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >>  4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >>  8)) & 0x0000FFFF0000FFFF
+    v = (v | (v >> 16)) & 0xFFFFFFFF
+    return v
+
+#Header of a saved index: magic, format version, scale of the keys (-1 if
+#they have different scales), flags, number of cells, and number of postings
+_INDEX_MAGIC = b'SPDX'
+_INDEX_VERSION = 2
+_INDEX_HEADER = '<4sIiIQQ'
+_INDEX_HEADER_SIZE = 32
+
+#flag of a saved index that has a second section for its boundary postings
+_INDEX_CLASSIFIED = 1
+
+def save_index(index, filepath):
+    """Save a spatial index to a compact binary file.
+
+       The file has a 32-byte header, then the sorted int64 keys of the
+       index's cells (see `cell_key`), then int64 offsets such that the
+       values of the `i`th cell are postings `offsets[i]` up to
+       `offsets[i+1]`, and then those postings as sorted int32s (padded to a
+       multiple of 8 bytes). Everything is little-endian and 8-byte aligned,
+       so `load_index` can memory-map the file instead of reading it.
+
+       If `index` has a `boundary` (a `ClassifiedIndex` or `QuadtreeIndex`),
+       the header says so, and the file goes on with a second section in the
+       same form (offsets, then int32 postings) for the values in `boundary`
+       of each of those cells, so `MappedIndex.classify` still works.
+
+       :param index: a dict from cells (`_Cell` objects or int keys) to sets
+       of ints >= 0, such as from `kml.spatial_index`
+       :param filepath: the name of the file to write
+       :returns: None
+       """
+    import numpy as np
+    import struct
+    
+    boundary = getattr(index, 'boundary', None)
+    entries = sorted((cell.int_key if isinstance(cell, _Cell) else int(cell),
+                      sorted(values),
+                      sorted(boundary.get(cell, ())) if boundary else [])
+                     for cell, values in index.items())
+    keys = np.array([entry[0] for entry in entries], dtype='<i8')
+    sections = [_postings([entry[1] for entry in entries])]
+    flags = 0
+    if boundary is not None:
+        sections.append(_postings([entry[2] for entry in entries]))
+        flags |= _INDEX_CLASSIFIED
+    
+    scales = {key_scale(key) for key in keys}
+    scale = scales.pop() if len(scales) == 1 else -1
+    header = struct.pack(_INDEX_HEADER, _INDEX_MAGIC, _INDEX_VERSION, scale,
+                         flags, len(keys), len(sections[0][1]))
+    with open(filepath, 'wb') as file:
+        file.write(header)
+        file.write(keys.tobytes())
+        for offsets, postings in sections:
+            file.write(offsets.tobytes())
+            file.write(postings.tobytes())
+            file.write(bytes(-postings.nbytes % 8)) #8-byte alignment
+
+def _postings(lists):
+    """Return the little-endian int64 offsets and int32 postings of the
+       sorted lists of values `lists`, as written by `save_index`."""
+    import numpy as np
+    offsets = np.zeros(len(lists) + 1, dtype='<i8')
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    postings = np.fromiter(itertools.chain.from_iterable(lists),
+                           dtype=np.int64, count=int(offsets[-1]))
+    if postings.size and not 0 <= postings.min() <= postings.max() < 2**31:
+        raise ValueError('index values must be from 0 to 2**31 - 1')
+    return offsets, postings.astype('<i4')
+
+def load_index(filepath, mmap=True):
+    """Load a spatial index saved by `save_index`.
+
+       :param filepath: the name of the file to read
+       :param mmap: if True (the default), memory-map the file so that
+       loading takes no time and pages are only read as queries touch them;
+       if False, read the whole file into memory
+       :returns: a `MappedIndex`
+       """
+    import numpy as np
+    import struct
+    
+    if mmap:
+        data = np.memmap(filepath, dtype=np.uint8, mode='r')
+    else:
+        data = np.fromfile(filepath, dtype=np.uint8)
+    if data.size < _INDEX_HEADER_SIZE:
+        raise ValueError('not a spatial index file: ' + str(filepath))
+    magic, version, scale, flags, count, total = struct.unpack(
+            _INDEX_HEADER, data[:_INDEX_HEADER_SIZE].tobytes())
+    if magic != _INDEX_MAGIC:
+        raise ValueError('not a spatial index file: ' + str(filepath))
+    if version not in (1, _INDEX_VERSION):
+        raise ValueError(f'unsupported spatial index version {version}')
+    
+    start = _INDEX_HEADER_SIZE
+    keys = data[start:start + 8*count].view('<i8')
+    start += 8*count
+    offsets = data[start:start + 8*(count+1)].view('<i8')
+    start += 8*(count+1)
+    postings = data[start:start + 4*total].view('<i4')
+    boundary = None
+    if flags & _INDEX_CLASSIFIED:
+        start += 4*total + -4*total % 8
+        edge_offsets = data[start:start + 8*(count+1)].view('<i8')
+        start += 8*(count+1)
+        edge_postings = data[start:start + 4*int(edge_offsets[-1])
+                             ].view('<i4')
+        boundary = edge_offsets, edge_postings
+    return MappedIndex(keys, offsets, postings,
+                       None if scale < 0 else scale, boundary)
+
+class MappedIndex:
+    """A read-only spatial index backed by arrays, as from `load_index`.
+
+       It acts like the dict from `kml.spatial_index(..., keys=True)`:
+       indexing it with a cell (an int key or a `_Cell`) gives the set of
+       ints for that cell. A lookup is a binary search of the sorted keys,
+       and nothing is unpacked until it's asked for.
+       
+       Like a `ClassifiedIndex`, it can `classify` a cell's values. If it was
+       saved without a boundary, every value needs an exact test."""
+    
+    def __init__(self, keys, offsets, postings, scale=None, boundary=None):
+        """:param keys: sorted int64 array of cell keys
+           :param offsets: int64 array, one longer than `keys`, of where each
+           cell's postings start
+           :param postings: int array of the values of all cells in order
+           :param scale: the scale of all the keys, or None if they differ
+           :param boundary: None, or the offsets and postings, in the same
+           form, of the values whose boundaries cross each cell
+           """
+        self.keys_array = keys
+        self.offsets = offsets
+        self.postings_array = postings
+        self.scale = scale
+        self.boundary = boundary
+    
+    def _position(self, cell):
+        import numpy as np
+        key = cell.int_key if isinstance(cell, _Cell) else int(cell)
+        i = int(np.searchsorted(self.keys_array, key))
+        if i < len(self.keys_array) and self.keys_array[i] == key:
+            return i
+        return None
+    
+    def postings(self, cell):
+        """Return a zero-copy array of the values for `cell` (empty if
+           `cell` isn't in the index)."""
+        i = self._position(cell)
+        if i is None:
+            return self.postings_array[:0]
+        return self.postings_array[self.offsets[i]:self.offsets[i+1]]
+    
+    def _find(self, point):
+        """Return the position of the cell containing `point`, or None.
+
+           If the keys have different scales (as saved from a
+           `QuadtreeIndex`), look for that cell from the coarsest scale to
+           the finest."""
+        if self.scale is not None:
+            return self._position(get_key(point, self.scale))
+        if not len(self):
+            return None
+        for scale in range(key_scale(self.keys_array[0]),
+                           key_scale(self.keys_array[-1]) + 1):
+            i = self._position(get_key(point, scale))
+            if i is not None:
+                return i
+        return None
+    
+    def _classify_at(self, i):
+        values = set(self.postings_array[self.offsets[i]:self.offsets[i+1]
+                                         ].tolist())
+        if self.boundary is None:
+            return set(), values
+        offsets, postings = self.boundary
+        edge = set(postings[offsets[i]:offsets[i+1]].tolist())
+        return values - edge, edge
+    
+    def query(self, point):
+        """Return the set of values for the cell containing `point`."""
+        i = self._find(point)
+        if i is None:
+            return set()
+        return set(self.postings_array[self.offsets[i]:self.offsets[i+1]
+                                       ].tolist())
+    
+    def classify(self, cell):
+        """Return the set of values covering `cell` and the set of values
+           whose boundaries cross it (see `ClassifiedIndex.classify`)."""
+        i = self._position(cell)
+        return (set(), set()) if i is None else self._classify_at(i)
+    
+    def query_classified(self, point):
+        """Return the set of values certainly containing `point` and the set
+           of values that need an exact test, as from `classify`."""
+        i = self._find(point)
+        return (set(), set()) if i is None else self._classify_at(i)
+    
+    def __len__(self):
+        return len(self.keys_array)
+    
+    def __contains__(self, cell):
+        return self._position(cell) is not None
+    
+    def __getitem__(self, cell):
+        i = self._position(cell)
+        if i is None:
+            raise KeyError(cell)
+        return set(self.postings_array[self.offsets[i]:self.offsets[i+1]
+                                       ].tolist())
+    
+    def get(self, cell, default=None):
+        try:
+            return self[cell]
+        except KeyError:
+            return default
+    
+    def __iter__(self):
+        return iter(self.keys_array.tolist())
+    
+    def keys(self):
+        return self.keys_array.tolist()
+    
+    def values(self):
+        postings = self.postings_array.tolist()
+        offsets = self.offsets.tolist()
+        return [set(postings[offsets[i]:offsets[i+1]])
+                for i in range(len(self))]
+    
+    def items(self):
+        return zip(self.keys(), self.values())
+
+class ClassifiedIndex(dict):
+    """A spatial index that knows which of its values only touch a cell.
+
+       It maps each cell to the set of values (say, polygons) intersecting
+       it, like any spatial index, and `boundary` maps each cell to the
+       subset of those values whose boundaries cross it. Every other value
+       of a cell covers all of it, so a point in the cell is certainly in
+       those, and only the boundary values need an exact test."""
+    
+    def __init__(self):
+        super().__init__()
+        self.boundary = {}
+    
+    def add(self, cell, value, boundary=False):
+        """Index `value` at `cell`, as crossing the cell's interior with its
+           boundary if `boundary` is True or covering the cell if not."""
+        try:
+            self[cell].add(value)
+        except KeyError:
+            self[cell] = {value}
+        if boundary:
+            try:
+                self.boundary[cell].add(value)
+            except KeyError:
+                self.boundary[cell] = {value}
+    
+    def classify(self, cell):
+        """Return the set of values covering `cell` and the set of values
+           whose boundaries cross it."""
+        edge = self.boundary.get(cell, set())
+        return self.get(cell, set()) - edge, edge
+
+class QuadtreeIndex(ClassifiedIndex):
+    """A spatial index whose cells have different scales.
+
+       It maps int keys (see `cell_key`) to sets of values like a
+       single-scale index does, but a key can be of any scale from
+       `min_scale` to `max_scale`, and no two of its cells overlap. Big
+       areas where nothing changes are covered by a few coarse cells, and
+       only the places that need it are covered by fine ones. See
+       `kml.spatial_quadtree`."""
+    
+    def __init__(self, min_scale, max_scale):
+        super().__init__()
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+    
+    def cell_for(self, point):
+        """Return the key of the cell of this index containing `point`, or
+           None, descending from the coarsest scale to the finest."""
+        for scale in range(self.min_scale, self.max_scale + 1):
+            key = get_key(point, scale)
+            if key in self:
+                return key
+        return None
+    
+    def query(self, point):
+        """Return the set of values for the cell containing `point`."""
+        key = self.cell_for(point)
+        return set() if key is None else self[key]
+    
+    def query_classified(self, point):
+        """Return the set of values certainly containing `point` and the set
+           of values that need an exact test, as from `classify`."""
+        key = self.cell_for(point)
+        return (set(), set()) if key is None else self.classify(key)
+
 class _Cell:
     """A rectangular region on a Mercator projection of the surface of Earth.
 
@@ -226,18 +795,29 @@ class _Cell:
        generally with an increase of scale by 1, there are four times as many
        cells in total.
        
+       Where many cells are needed, prefer the int keys of `cell_key` and the
+       `get_keys_*` functions, and make cells only to display them.
+       
        The prefered way to obtain instances of this class is to call `get`,
-       which caches results. Since a huge number of cells may be needed for
-       a given task, interning instances this way may save memory on
-       short-running tasks but may be a liability on long-running tasks.
+       which caches results. The cache is bounded (see `CELL_CACHE_CAPACITY`)
+       and drops the least recently used cells once full, so it can't grow
+       without limit on a long-running task. Use `cell_cache` to give a job
+       its own cache, and `cell_cache_stats` to see how well it's working.
        """
-    _INTERN_CACHE = Canon()
+    _INTERN_CACHE = Canon(capacity=CELL_CACHE_CAPACITY)
     
     @staticmethod
-    def get(x_index, y_index, scale, cache=_INTERN_CACHE):
+    def get(x_index, y_index, scale, cache=None):
+        if cache is None:
+            cache = _Cell._INTERN_CACHE
         return cache.single(
                 _Cell(x_index, y_index, scale))
     
+    @staticmethod
+    def from_key(key):
+        """Return a (non-interned) cell from its key (see `cell_key`)."""
+        return _Cell(*key_indices(int(key)))
+    
     @staticmethod
     def width(scale):
         return 360 / 2**scale
@@ -265,6 +845,10 @@ class _Cell:
     def key(self):
         return (self.x, self.y, self.scale)
     
+    @property
+    def int_key(self):
+        return cell_key(self.x, self.y, self.scale)
+    
     @property
     def indices(self):
         yield self.x
@@ -9,63 +9,40 @@ It is difficult to explain why that association makes sense. See the
 (https://www.smbc-comics.com/comic/2014-02-24) for an explanation of 
 why it is difficult to explain."""
 
-def _orientation(side):
-    """Return -1 or 1 based on the orientation from the first to last point.
-    """
-    a, b = side
-    if a < b:
-        return 1
-    elif a > b:
-        return -1
-    else:
-        raise ValueError('side connects a vertex to itself: ' + str(side))
+def _net_sides(topology):
+    """Return the vertex ids at the starts and ends of the net sides.
 
-class _SideMinder(dict):
-    """A class to keep track of the sums of many directed edges (polygon sides).
+       Sides are grouped by sorting their packed keys, and each group's
+       directions (+1 from the lesser vertex id to the greater, -1 the other
+       way) are summed. A side whose net direction is 0 is cancelled out by
+       a neighbor's opposite side; the rest survive, pointing the way their
+       sum says.
 
-       When a given side's net orientation is 0, remove that side as a key
-       to save space in memory."""
-    
-    def __missing__(self, key):
-        return 0
-
-    def __setitem__(self, key, value):
-        if value == 0:
-            try:
-                self.__delitem__(key)
-            except KeyError:
-                pass
-        elif abs(value) == 1:
-            super(_SideMinder, self).__setitem__(key, value)
-        else:
-            raise ValueError(f'net orientation ({value}) of edge ({side}) '
-                              'outside allowed range. This may mean that inner '
-                              'and outer boundaries curl in the same direction.')
-    
-    def add(self, side):
-        """Add `side` to the pile of directed sides already present.
-
-           If another side with the same points and opposite direction is
-           already counted, then the count for the corresponding undirected side
-           becomes zero and the corresponding key is removed from the underlying
-           dict altogether to save space."""
-        
-        verts = frozenset(side)
-        self[verts] += _orientation(side)
-    
-    def net_sides(self):
-        nets = set()
-        for frznst, orinttn in self.items():
-            x,y = frznst
-            points_alphabetical = (x,y)
-            points_alphabetical_reverse = (y,x)
-            if _orientation(points_alphabetical) == orinttn:
-                nets.add(points_alphabetical)
-            elif _orientation(points_alphabetical_reverse) == orinttn:
-                nets.add(points_alphabetical_reverse)
-            else:
-                raise ValueError('impossible orientation situation')
-        return nets
+       :param topology: a `topology.Topology` of the boundaries
+       :returns: two int64 arrays
+       """
+    import numpy as np
+    from topology import unpack
+    order = np.argsort(topology.keys, kind='stable')
+    keys = topology.keys[order]
+    signs = np.where(topology.starts < topology.ends, 1, -1)[order]
+    if not len(keys):
+        return keys, keys
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    heads = np.flatnonzero(first)
+    nets = np.add.reduceat(signs, heads)
+    bad = np.flatnonzero(np.abs(nets) > 1)
+    if len(bad):
+        lo, hi = unpack(keys[heads[bad[0]]])
+        side = (topology.point(int(lo)), topology.point(int(hi)))
+        raise ValueError(f'net orientation ({nets[bad[0]]}) of edge ({side}) '
+                          'outside allowed range. This may mean that inner '
+                          'and outer boundaries curl in the same direction.')
+    keep = nets != 0
+    lo, hi = unpack(keys[heads[keep]])
+    forward = nets[keep] > 0
+    return np.where(forward, lo, hi), np.where(forward, hi, lo)
 
 def _cross_product(de1, de2):
     """Return the cross product of the vectors defined by the directed edges."""
@@ -98,23 +75,27 @@ def _sides(boundary):
         if old is not None:
             yield old, new
 
-def stokes(polygons):
+def stokes(polygons, tolerance=None):
     """Add oriented sides so only a net boundary (usually exterior) survives.
 
        Return a list of the net boundaries that are the sum of the directed
        boundaries supplied by `polygons`. The curl scheme of the original
        polygons is inherited by the return value.
        
-       :param polygons: an iterable of outer and inner boundaries"""
+       :param polygons: an iterable of outer and inner boundaries
+       :param tolerance: if given, snap vertices to a grid with this spacing
+       first, so that nearly-equal vertices count as the same vertex (see
+       `topology.Topology`)"""
     
-    side_adder = _SideMinder()
-    for polygon in polygons:
-        for side in _sides(polygon):
-            side_adder.add(side)
+    from topology import Topology
+    topology = Topology(polygons, tolerance=tolerance)
     del polygons
     
-    net_sides = side_adder.net_sides()
-    del side_adder
+    starts, ends = _net_sides(topology)
+    points = topology.points()
+    net_sides = {(points[a], points[b])
+                 for a, b in zip(starts.tolist(), ends.tolist())}
+    del topology, points
     
     vertex_to_sides = {}
     for side in net_sides:
@@ -0,0 +1,80 @@
+import numpy as np
+
+import kml
+from kml import coords
+
+MIXED = '1,2,3 4,5 6,7,8,9'
+
+def test_parse_uniform_width():
+    assert coords.parse('1,2,0 3,4,0').tolist() == [[1, 2], [3, 4]]
+    assert coords.parse(' 1,2 3,4 ', dims=2).tolist() == [[1, 2], [3, 4]]
+
+def test_parse_mixed_width():
+    #the totals of values and commas match a uniform width of 3 here
+    assert coords.parse(MIXED).tolist() == [[1, 2], [4, 5], [6, 7]]
+
+def test_parse_too_few_dims():
+    try:
+        coords.parse('1,2 3', dims=2)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('expected ValueError')
+
+def test_parse_many_mixed_width():
+    points, offsets = coords.parse_many([MIXED, '1,1 2,2'])
+    assert points.tolist() == [[1, 2], [4, 5], [6, 7], [1, 1], [2, 2]]
+    assert offsets.tolist() == [0, 3, 5]
+
+def _soup(text):
+    """Return a KML document with one LineString with coordinates `text`."""
+    return kml.parse('<kml><Document><Placemark><LineString><coordinates>' +
+                     text +
+                     '</coordinates></LineString></Placemark></Document>'
+                     '</kml>')
+
+def _docked(text, batch):
+    soup = _soup(text)
+    kml.dock(soup, decimals=2, dims=2, batch=batch)
+    return soup.coordinates.string
+
+def test_dock_batch_mixed_width():
+    text = '1.234,2.345,3 4.5,5.5 6.125,7.125,8,9'
+    assert _docked(text, True) == _docked(text, False) == \
+           '1.23,2.34 4.5,5.5 6.12,7.12'
+
+def test_points_from_store_and_text_agree():
+    tag = _soup(MIXED).coordinates
+    assert coords.points(tag) == [(1.0, 2.0), (4.0, 5.0), (6.0, 7.0)]
+    assert np.array_equal(coords.parse(MIXED), np.array(coords.points(tag)))
+
+def test_lxml_store_does_not_grow():
+    #lxml makes a new proxy for an element on each visit unless one is alive
+    text = ''.join(f'<Placemark><LineString><coordinates>{i},1 {i},2'
+                   f'</coordinates></LineString></Placemark>'
+                   for i in range(50))
+    soup = kml.parse(f'<kml><Document>{text}</Document></kml>',
+                     backend='lxml')
+    store = coords.cache(soup)
+    try:
+        for _ in range(3):
+            for tag in kml.etree.find_all(soup, 'coordinates'):
+                kml.coords_from_tag(tag)
+                coords.array(tag)
+        assert len(store) == 50
+    finally:
+        coords.uncache(soup)
+
+def test_array_views_store():
+    soup = _soup(MIXED)
+    tag = soup.coordinates
+    store = coords.cache(soup)
+    points = coords.array(tag)
+    assert np.array_equal(points, coords.parse(MIXED))
+    assert np.shares_memory(points, np.frombuffer(store.values))
+    assert not points.flags.writeable
+    
+    #the store can't grow in place while `points` views it
+    kml.etree.set_string(tag, '7,8 9,10')
+    assert coords.array(tag).tolist() == [[7, 8], [9, 10]]
+    assert points.tolist() == [[1, 2], [4, 5], [6, 7]]
@@ -0,0 +1,20 @@
+from lxml import etree
+
+import kml
+
+PREFIXED = ('<kml:kml xmlns:kml="http://www.opengis.net/kml/2.2" '
+            'xmlns:gx="http://www.google.com/kml/ext/2.2">'
+            '<kml:Document><kml:name> a </kml:name><gx:Tour/></kml:Document>'
+            '</kml:kml>')
+
+def test_prefixed_root_keeps_children_in_kml_namespace():
+    root = kml.parse(PREFIXED, backend='lxml')
+    text = kml.etree.tostring(root)
+    assert 'kml:' not in text
+    assert '<Document><name>a</name><gx:Tour/></Document>' in text
+    
+    #read back, every KML element is in the KML namespace
+    reread = etree.fromstring(text.encode('utf-8'))
+    assert [etree.QName(e).namespace for e in reread.iter()] == \
+           [kml.etree.KML_NS] * 3 + ['http://www.google.com/kml/ext/2.2']
+    assert kml.etree.find(root, 'name').text == 'a'
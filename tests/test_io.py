@@ -0,0 +1,91 @@
+import random
+
+from bs4 import BeautifulSoup
+from bs4.element import CData, NavigableString, Tag
+
+from kml.io import REPLACE, _as_html, format
+
+def _synthetic_kml(placemark_count, vertices=5, seed=0, blank=True):
+    """Return the text of a KML document with `placemark_count` Placemarks.
+
+       Each Placemark has padded strings, a description that needs CDATA,
+       an empty tag, some data (with a blank value if `blank`), and a polygon
+       with `vertices` vertices. Tags carry "kml:" prefixes."""
+    rand = random.Random(seed)
+    pms = []
+    for i in range(placemark_count):
+        x, y = rand.uniform(-120, -70), rand.uniform(25, 48)
+        ring = [(x + rand.random(), y + rand.random())
+                for _ in range(vertices)]
+        ring.append(ring[0])
+        coords = ' '.join(f'{a},{b},0' for a, b in ring)
+        pms.append(f"""
+    <kml:Placemark>
+      <kml:name>  precinct {i}  </kml:name>
+      <kml:description>  &lt;table&gt;&lt;tr&gt;&lt;td&gt;{i}&lt;/td&gt;&lt;/tr&gt;&lt;/table&gt;  </kml:description>
+      <kml:styleUrl> #color{i % 4 + 1} </kml:styleUrl>
+      <kml:Snippet/>
+      <kml:ExtendedData>
+        <kml:Data name="id"><kml:value> {i} </kml:value></kml:Data>
+        {'<kml:Data name="note"><kml:value>   </kml:value></kml:Data>'
+         if blank else ''}
+      </kml:ExtendedData>
+      <kml:Polygon><kml:outerBoundaryIs><kml:LinearRing><kml:coordinates>
+        {coords}
+      </kml:coordinates></kml:LinearRing></kml:outerBoundaryIs></kml:Polygon>
+    </kml:Placemark>""")
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<kml:kml xmlns:kml="http://www.opengis.net/kml/2.2">'
+            '<kml:Document>' + ''.join(pms) + '</kml:Document></kml:kml>')
+
+def _format_reference(soup, no_empty=False):
+    """The multi-pass `kml.io.format` that the current one replaced."""
+    strip = []
+    destroy = []
+    for e in list(soup.descendants):
+        if isinstance(e, NavigableString):
+            if e.parent is None:
+                continue
+            if e.isspace():
+                destroy.append(e)
+            elif e.strip() != e:
+                strip.append(e)
+        elif isinstance(e, Tag):
+            if e.prefix == "kml":
+                e.prefix = None
+            if e.string and e.string.parent is e:
+                e.string = e.string.strip()
+                if any(c in e.string for c in REPLACE):
+                    cdata = CData(e.string)
+                    if len(str(cdata)) <= len(_as_html(e.string)):
+                        e.string = cdata
+    for d in destroy:
+        d.extract()
+    for s in strip:
+        s.replace_with(s.strip())
+    if no_empty:
+        for tag in soup(lambda thing : isinstance(thing,Tag) and
+                        len(list(thing.contents)) == 0):
+            tag.decompose()
+
+def test_format_matches_multi_pass_reference():
+    text = _synthetic_kml(50, blank=False)
+    for no_empty in (False, True):
+        expected = BeautifulSoup(text, 'xml')
+        _format_reference(expected, no_empty=no_empty)
+        soup = BeautifulSoup(text, 'xml')
+        format(soup, no_empty=no_empty)
+        assert str(soup) == str(expected)
+        assert 'kml:' not in str(soup).replace('xmlns:kml', '')
+        assert ('<Snippet/>' in str(soup)) != no_empty
+
+def test_format_blank_value():
+    #the multi-pass version left an empty string in a blank tag, so it
+    #printed as <value></value> and `no_empty` didn't remove it
+    text = _synthetic_kml(1)
+    soup = BeautifulSoup(text, 'xml')
+    format(soup)
+    assert '<Data name="note"><value/></Data>' in str(soup)
+    soup = BeautifulSoup(text, 'xml')
+    format(soup, no_empty=True)
+    assert '<Data name="note"/>' in str(soup)
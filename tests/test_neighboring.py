@@ -0,0 +1,127 @@
+import numpy as np
+
+import neighboring
+
+def test_near_sides_matches_all_pairs():
+    rand = np.random.default_rng(25)
+    for trial in range(40):
+        n = int(rand.integers(2, 120))
+        p = rand.random((n, 2)) * 4
+        #mostly short sides, some spanning most of the map
+        reach = np.where(rand.random(n) < 0.1, 4.0, 0.2)[:, None]
+        q = p + (rand.random((n, 2)) - 0.5) * reach
+        if trial % 2:
+            p, q = np.round(p * 4) / 4, np.round(q * 4) / 4
+        owners = rand.integers(0, 5, n)
+        tolerance = 0.0 if trial % 4 == 1 else float(rand.random()) * 0.05
+        s, t = np.triu_indices(n, 1)
+        other = owners[s] != owners[t]
+        s, t = s[other], t[other]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            near = neighboring._side_distances(p[s], q[s], p[t], q[t])
+        near = near <= tolerance
+        for scale in (None, 3, 9):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                got = neighboring._near_sides(p, q, owners, tolerance, scale)
+            assert np.array_equal(got[0], s[near]), (trial, scale)
+            assert np.array_equal(got[1], t[near]), (trial, scale)
+
+def _jittered_grid(n, noise=0.0, seed=0):
+    """Return an `n` by `n` grid of square Polygons that share their sides,
+       with every lattice point moved a little at random, and each shape's
+       copy of it moved by up to `noise` more."""
+    import random
+    from point_in_polygon import Polygon
+    rand = random.Random(seed)
+    lattice = {(i, j): (-90 + (i + rand.uniform(-0.3, 0.3)) / 10,
+                        30 + (j + rand.uniform(-0.3, 0.3)) / 10)
+               for i in range(n + 1) for j in range(n + 1)}
+    
+    def point(i, j):
+        x, y = lattice[i, j]
+        return x + rand.uniform(-noise, noise), y + rand.uniform(-noise, noise)
+    
+    shapes = []
+    for i in range(n):
+        for j in range(n):
+            ring = [point(i, j), point(i+1, j), point(i+1, j+1),
+                    point(i, j+1)]
+            shapes.append(Polygon([ring + ring[:1]]))
+    return shapes
+
+def test_seamless_chunked_matches_seamless(tmp_path):
+    for noise, tolerance in ((0.0, None), (0.0, 1e-9), (1e-11, 1e-6)):
+        shapes = _jittered_grid(14, noise)
+        expected = neighboring.seamless(shapes, tolerance)
+        if not noise:
+            assert len(expected) == 14 * 14 + 2 * 14 * 13
+        for memory in (64, 500, 1200, 5000, 2**30):
+            assert neighboring.seamless_chunked(
+                    shapes, memory, tolerance, str(tmp_path)) == expected
+    assert not list(tmp_path.iterdir())
+
+def test_seamless_chunked_three_shapes_on_a_side(tmp_path):
+    from point_in_polygon import Polygon
+    shapes = _jittered_grid(3)
+    #a copy of the middle square shares all four of its sides with a third
+    #shape
+    shapes.append(Polygon([list(shapes[4].outers[0])]))
+    tempdir = str(tmp_path)
+    for match in (lambda : neighboring.seamless(shapes),
+                  lambda : neighboring.seamless_chunked(shapes, 64,
+                                                        tempdir=tempdir)):
+        try:
+            match()
+        except Exception as e:
+            assert 'more than two shapes' in str(e)
+        else:
+            raise AssertionError('expected an exception')
+
+def _gapped_grid(n, gap=1e-4, k=10, seed=0):
+    """Return an `n` by `n` grid of CompactPolygons a tenth of a degree
+       wide, with each side of each square split into `k` sides, a gap of
+       `2 * gap` tenths of a degree between neighbors, and every vertex
+       moved a little at random."""
+    import random
+    from point_in_polygon import CompactPolygon
+    rand = random.Random(seed)
+    shapes = []
+    for i in range(n):
+        for j in range(n):
+            x0, y0, x1, y1 = i + gap, j + gap, i + 1 - gap, j + 1 - gap
+            ring = ([(x0 + (x1 - x0) * t / k, y0) for t in range(k)] +
+                    [(x1, y0 + (y1 - y0) * t / k) for t in range(k)] +
+                    [(x1 - (x1 - x0) * t / k, y1) for t in range(k)] +
+                    [(x0, y1 - (y1 - y0) * t / k) for t in range(k)])
+            ring = [(x / 10 - 90 + rand.uniform(-1e-6, 1e-6),
+                     y / 10 + 30 + rand.uniform(-1e-6, 1e-6))
+                    for x, y in ring]
+            shapes.append(CompactPolygon([ring + ring[:1]]))
+    return shapes
+
+def test_fuzzy_same_for_any_workers_and_batching():
+    shapes = _gapped_grid(8)
+    serial = neighboring.fuzzy(shapes, probe_factor=20, scale=10,
+                               batched=False)
+    assert len(serial) == 8 * 8 + 2 * 8 * 7
+    for workers in (1, 2):
+        assert neighboring.fuzzy(shapes, probe_factor=20, scale=10,
+                                 workers=workers) == serial
+
+def test_containing_tiled_matches_containing():
+    shapes = _gapped_grid(5)
+    rand = np.random.default_rng(24)
+    points = np.column_stack((rand.uniform(-90.05, -89.45, 3000),
+                              rand.uniform(29.95, 30.55, 3000)))
+    #and points on the squares' corners and in the gaps
+    corners = np.concatenate([shape.coords for shape in shapes])
+    points = np.concatenate((points, corners, corners + 1e-5))
+    for scale in (8, 12):
+        expected = neighboring._containing(
+                points, shapes, neighboring._cell_to_shapes(shapes, scale),
+                scale)
+        expected = sorted(zip(*(a.tolist() for a in expected)))
+        for workers in (2, 3):
+            rows, ids = neighboring._containing_tiled(points, shapes, scale,
+                                                      workers)
+            assert sorted(zip(rows.tolist(), ids.tolist())) == expected
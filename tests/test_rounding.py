@@ -0,0 +1,57 @@
+import random
+
+import rounding
+
+def _strings(rand, count):
+    """Return `count` random number strings: ties, leading points, negative
+       numbers, ints, and long tails."""
+    strings = []
+    for _ in range(count):
+        head = rand.choice(['', '0', str(rand.randrange(10)),
+                            str(rand.randrange(10**6))])
+        tail = ''.join(rand.choice('0123456789')
+                       for _ in range(rand.randrange(16)))
+        kind = rand.randrange(4)
+        if kind == 0 and tail: #a tie at some length
+            cut = rand.randrange(len(tail))
+            tail = tail[:cut] + '5' + '0' * rand.randrange(3)
+        if kind == 1:
+            string = head or '0'
+        else:
+            string = head + '.' + (tail if head or tail else '5')
+        if rand.random() < 0.4:
+            string = '-' + string
+        strings.append(string)
+    return strings
+
+def test_floats_matches_float():
+    rand = random.Random(0)
+    strings = _strings(rand, 3000)
+    for length in range(14):
+        expected = [rounding.float(s, length) for s in strings]
+        assert rounding.floats(strings, length).tolist() == expected, length
+
+def test_leading_point():
+    assert rounding.float('.1234561', 6) == '.123456'
+    assert rounding.floats(['.1234561'], 6).tolist() == ['.123456']
+    assert rounding.floats(['.1234567'], 6).tolist() == ['0.123457']
+    assert rounding.floats(['-.95'], 1).tolist() == ['-1.0']
+
+def test_ties_round_to_even():
+    strings = ['0.125', '0.135', '-2.5', '3.5', '0.5', '1.05']
+    assert rounding.floats(strings, 2).tolist() == \
+           ['0.12', '0.14', '-2.5', '3.5', '0.5', '1.05']
+    assert rounding.floats(strings, 0).tolist() == \
+           ['0', '0', '-2', '4', '0', '1']
+
+def test_length_zero():
+    for string, expected in [('2.7', '3'), ('2.5', '2'), ('.4', '0'),
+                             ('-0.4', '-0'), ('9.5', '10'), ('7', '7')]:
+        assert rounding.float(string, 0) == expected
+        assert rounding.floats([string], 0).tolist() == [expected]
+
+def test_big_values():
+    strings = ['123456789012.1234567', '-98765432109.87654321']
+    for length in (3, 6):
+        assert rounding.floats(strings, length).tolist() == \
+               [rounding.float(s, length) for s in strings]
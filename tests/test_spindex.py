@@ -0,0 +1,249 @@
+import math
+import random
+
+import geometry
+import spindex
+from point_in_polygon import Polygon, _Ring
+
+def _flood_cells(rings, scale):
+    """Return the set of cells that intersect the polygon with boundaries
+       `rings` (even-odd), by the flood fill that `get_cells_2d` used before
+       it became a scanline fill.
+
+       Every cell of the bounding box is built, and each connected component
+       of the cells no boundary crosses is in the polygon or out of it as a
+       whole, depending on where one of its centers is."""
+    rings = [_Ring(points) for points in rings]
+    cells = set().union(*(spindex.get_cells_1d(ring, scale)
+                          for ring in rings))
+
+    min_x, max_x, min_y, max_y = sum(
+            (spindex._BBox(x,x,y,y)
+             for x,y in (cell.indices for cell in cells)),
+            spindex._BBox(float('inf'), float('-inf'),
+                          float('inf'), float('-inf')))
+    unassigned = {(x,y)
+                  for x in range(min_x, max_x+1)
+                  for y in range(min_y, max_y+1)
+                  } - {tuple(cell.indices)
+                       for cell in cells}
+
+    while unassigned:
+        cell = next(iter(unassigned))
+        news = {cell}
+        core = set()
+        while news:
+            edge, news = news, set()
+            for x,y in edge:
+                news.update([(x+1,y), (x-1,y), (x,y+1), (x,y-1)])
+            core |= edge
+            news -= core
+            news &= unassigned
+        unassigned -= core
+        center = spindex._Cell.get(cell[0], cell[1], scale).center
+        if sum(center in ring for ring in rings) % 2:
+            cells.update(spindex._Cell.get(x,y,scale) for x,y in core)
+    return cells
+
+def _star(rand, center, r_min, r_max, snap=None):
+    """Return a random closed ring around `center` whose vertices are between
+       `r_min` and `r_max` from it, optionally snapped to multiples of the
+       pair `snap`."""
+    cx, cy = center
+    count = rand.randrange(5, 12)
+    step = 2 * math.pi / count
+    angles = [(k + rand.uniform(-0.3, 0.3)) * step for k in range(count)]
+    ring = []
+    for angle in angles:
+        r = rand.uniform(r_min, r_max)
+        x, y = cx + r * math.cos(angle), cy + r * math.sin(angle)
+        if snap:
+            x = round(x / snap[0]) * snap[0]
+            y = round(y / snap[1]) * snap[1]
+        if not ring or ring[-1] != (x, y):
+            ring.append((x, y))
+    ring.append(ring[0])
+    return ring
+
+def _box(x0, y0, x1, y1):
+    return [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]
+
+def _polygons(rand, scale):
+    """Yield random (outer, hole or None) pairs of rings at `scale`: stars,
+       stars with vertices on cell corners and cell midlines, and boxes with
+       edges on grid lines.
+
+       A star's sides stay more than a third of its size from its center
+       (its vertices' angles are spread out), so a hole of a fifth of its
+       size fits inside it even after both are snapped."""
+    width, height = spindex._Cell.dims(scale)
+    for i in range(60):
+        center = (rand.uniform(-90, 90), rand.uniform(-45, 45))
+        size = rand.uniform(*[(1, 8), (10, 16)][i % 2]) * width
+        snap = [None, (width, height), (width / 2, height / 2)][i % 3]
+        if snap:
+            center = (round(center[0] / width) * width,
+                      round(center[1] / height) * height)
+        outer = _star(rand, center, size / 2, size, snap)
+        hole = None
+        if i % 2:
+            hole = _star(rand, center, size / 10, size / 5, snap)
+        if len(outer) > 3 and (hole is None or len(hole) > 3):
+            yield outer, hole
+    for _ in range(20):
+        x0, y0 = rand.randrange(-16, 4), rand.randrange(-16, 4)
+        x1, y1 = x0 + rand.randrange(3, 12), y0 + rand.randrange(3, 12)
+        outer = _box(x0 * width, y0 * height, x1 * width, y1 * height)
+        hole = _box((x0 + 1) * width, (y0 + 1) * height,
+                    (x1 - 1) * width, (y1 - 1) * height)
+        yield outer, hole if x1 - x0 > 2 and y1 - y0 > 2 else None
+
+def test_get_cells_2d_matches_flood_fill():
+    rand = random.Random(8)
+    for scale in (5, 7, 9):
+        for outer, hole in _polygons(rand, scale):
+            if hole is None:
+                expected = _flood_cells([outer], scale)
+                assert spindex.get_cells_2d(outer, scale) == expected
+                keys = {spindex.cell_key(*cell.indices, scale)
+                        for cell in expected}
+                assert spindex.get_keys_2d(outer, scale) == keys
+                assert set(spindex.get_key_array_2d(outer, scale).tolist()
+                           ) == keys
+            else:
+                expected = _flood_cells([outer, hole], scale)
+                polygon = Polygon([outer], [hole])
+                assert polygon.spatial_index(scale) == expected
+
+def _passthru(cell, point_a, point_b):
+    signs = [geometry.cross_sign(point_a, point_b, point_c)
+             for point_c in cell.corners]
+    if 1 in signs and -1 in signs:
+        return True
+    z = signs.count(0)
+    if z > 2:
+        raise ValueError("Impossible: Can't have more than 2 cell corners "
+                         "perfectly sitting on a line.")
+    elif z == 2:
+        nw, ne, se, sw = signs
+        return sw == 0 and (nw == 0 or se == 0)
+    return False
+
+def _grow_cells_line_segment(side, scale):
+    """Return the set of cells that intersect `side`, by growing out from
+       the cells of its ends, as `get_cells_1d` did before it walked the
+       grid with `spindex._walk_line_segment`.
+
+       A neighbor of a cell found so far intersects `side` if the cross
+       products of `side` with the vectors to the neighbor's corners have
+       both signs (or if the side runs along its south or west edge), and
+       the neighbor overlaps the side's bounding box."""
+    (xa,ya),(xb,yb) = a,b = side
+    cell_a, cell_b = (spindex.get_cell(point, scale) for point in side)
+
+    box = spindex._BBox(*(sorted([xa, xb]) + sorted([ya, yb])))
+
+    def hit(cell):
+        return (_passthru(cell, a, b) and
+                box.dim == (spindex._BBox(cell) & box).dim)
+
+    news = {cell_a, cell_b}
+    core = set()
+    while news:
+        edge, news = news, set()
+        for cell in edge:
+            news.update(cell.neighbors)
+        core |= edge
+        news -= core
+        news = {cell for cell in news if hit(cell)}
+
+    return {cell for cell in core if hit(cell)}
+
+def _sides(rand, scale, count):
+    """Return `count` random sides of nonzero length at `scale`: short and
+       long ones anywhere, diagonals from cell corner to cell corner, sides
+       along grid lines and cell midlines, and sides between points on them.
+    """
+    width, height = spindex._Cell.dims(scale)
+    sides = []
+    while len(sides) < count:
+        kind = rand.randrange(4)
+        if kind == 0:
+            xa, ya = rand.uniform(-100, 100), rand.uniform(-60, 60)
+            reach = rand.choice([1, 1, 4])
+            xb = xa + rand.uniform(-reach, reach) * width
+            yb = ya + rand.uniform(-reach, reach) * height
+        else:
+            i, j = rand.randrange(-40, 40), rand.randrange(-40, 40)
+            di, dj = rand.randrange(-4, 5), rand.randrange(-4, 5)
+            if kind == 1: #through cell corners
+                di = dj = rand.choice([-1, 1]) * rand.randrange(1, 4)
+            elif kind == 2: #along a grid line
+                di, dj = (di, 0) if rand.random() < 0.5 else (0, dj)
+            part = rand.choice([1, 2, 4])
+            xa, ya = i * width / part, j * height / part
+            xb, yb = xa + di * width / part, ya + dj * height / part
+        if (xa, ya) != (xb, yb):
+            sides.append(((xa, ya), (xb, yb)))
+    return sides
+
+def test_walk_line_segment_matches_growth():
+    rand = random.Random(9)
+    for scale in (2, 6, 10, 14):
+        for side in _sides(rand, scale, 1500):
+            expected = {tuple(cell.indices)
+                        for cell in _grow_cells_line_segment(side, scale)}
+            assert spindex._walk_line_segment(side, scale) == expected, side
+            assert spindex._walk_line_segment(side[::-1], scale) == \
+                   expected, side
+
+def _squares_kml(n):
+    """Return a KML document of an `n` by `n` grid of squares half a degree
+       wide, each with a square hole."""
+    placemarks = []
+    for i in range(n):
+        for j in range(n):
+            x, y = -90 + i / 2, 30 + j / 2
+            outer = _box(x, y, x + 0.5, y + 0.5)
+            hole = _box(x + 0.15, y + 0.2, x + 0.3, y + 0.35)
+            rings = [('outer', outer), ('inner', hole)]
+            placemarks.append(
+                    '<Placemark><Polygon>' +
+                    ''.join(f'<{kind}BoundaryIs><LinearRing><coordinates>' +
+                            ' '.join(f'{a},{b}' for a, b in ring) +
+                            f'</coordinates></LinearRing></{kind}BoundaryIs>'
+                            for kind, ring in rings) +
+                    '</Polygon></Placemark>')
+    return ('<kml><Document>' + ''.join(placemarks) + '</Document></kml>')
+
+def test_saved_index_keeps_boundary(tmp_path):
+    import kml
+    soup = kml.parse(_squares_kml(6))
+    path = str(tmp_path / 'index.bin')
+    rand = random.Random(14)
+    points = [(rand.uniform(-90.1, -86.9), rand.uniform(29.9, 33.1))
+              for _ in range(2000)]
+    indexes = [kml.spatial_index(soup, scale=10, keys=True, classify=True),
+               kml.spatial_quadtree(soup, scale=12, min_scale=6)]
+    for index in indexes:
+        kml.save_spatial_index(index, path)
+        for mmap in (True, False):
+            loaded = kml.load_spatial_index(path, mmap)
+            for key in index:
+                assert loaded[key] == index[key]
+                assert loaded.classify(key) == index.classify(key)
+            for point in points:
+                key = (index.cell_for(point)
+                       if isinstance(index, spindex.QuadtreeIndex) else
+                       spindex.get_key(point, 10))
+                expected = ((set(), set()) if key not in index else
+                            index.classify(key))
+                assert loaded.query_classified(point) == expected
+        del loaded
+    
+    #an index without a boundary leaves every value to an exact test
+    plain = kml.spatial_index(soup, scale=10, keys=True)
+    kml.save_spatial_index(plain, path)
+    loaded = kml.load_spatial_index(path)
+    assert loaded.boundary is None
+    assert all(loaded.classify(key) == (set(), plain[key]) for key in plain)
@@ -0,0 +1,143 @@
+"""Number the distinct vertices of many boundaries and pack their sides.
+
+`neighboring.seamless` and `stokes.stokes` both need to know which sides of
+which boundaries are the same side. Matching sides as frozensets of pairs of
+float tuples costs a hash of two tuples and a new frozenset per side, and for
+a big map that is most of their time and memory.
+
+A `Topology` instead gives each distinct vertex an int id once (optionally
+snapping the vertices to a grid first, so that nearly-equal vertices share
+an id), and represents every side as a pair of vertex ids, packed into one
+int64 key by `pack`. Sides are then matched by sorting their keys, all in
+NumPy."""
+
+#Each vertex id gets 32 bits of a packed side key, and keys must be positive
+MAX_VERTICES = 2**31
+
+def pack(a, b):
+    """Pack the vertex ids at the ends of sides into int64 keys.
+
+       A side has the same key whichever way it runs.
+
+       :param a: int array of the vertex ids at one end of each side
+       :param b: int array of the vertex ids at the other end of each side
+       :returns: int64 array of keys
+       """
+    import numpy as np
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    return (np.minimum(a, b) << 32) | np.maximum(a, b)
+
+def unpack(keys):
+    """Return the lesser and the greater vertex ids of the sides with `keys`.
+    """
+    import numpy as np
+    keys = np.asarray(keys, dtype=np.int64)
+    return keys >> 32, keys & 0xFFFFFFFF
+
+def ring_arrays(polygon):
+    """Return the outer and inner boundaries of `polygon` as a list of
+       (N, 2) float64 arrays.
+
+       The boundaries of a `CompactPolygon` are sliced straight out of its
+       vertex array without making its ring views."""
+    offsets = getattr(polygon, 'offsets', None)
+    if offsets is not None:
+        offsets = offsets.tolist()
+        return [polygon.coords[offsets[i]:offsets[i+1]]
+                for i in range(len(offsets) - 1)]
+    return [ring.array for ring in polygon._rings]
+
+class Topology:
+    """The distinct vertices of many boundaries and the sides between them.
+
+       `vertices[v]` is the point with vertex id `v`. Boundary `r` has the
+       vertex ids `ids[offsets[r]:offsets[r+1]]` and belongs to `owners[r]`
+       (for example the index of its polygon).
+
+       Side `s` runs from vertex `starts[s]` to vertex `ends[s]`, has the
+       packed key `keys[s]`, and is a side of boundary `rings[s]`. Sides whose
+       ends have the same vertex id (a repeated point, or two points snapped
+       together) are left out."""
+
+    def __init__(self, boundaries, owners=None, tolerance=None):
+        """:param boundaries: an iterable of boundaries, each a sequence of
+           points or an (N, dims) array, with its first point repeated as its
+           last
+           :param owners: the owner of each boundary; by default its index
+           :param tolerance: if given, snap the vertices to a grid with this
+           spacing before numbering them, so that vertices that round to the
+           same grid point get the same id. Two vertices closer than
+           `tolerance` can still round to neighboring grid points.
+           """
+        import numpy as np
+        arrays = [np.asarray(b, dtype=np.float64) for b in boundaries]
+        dims = next((a.shape[1] for a in arrays if a.ndim == 2), 2)
+        arrays = [a.reshape(-1, dims) for a in arrays]
+        lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+        self.offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        if owners is None:
+            self.owners = np.arange(len(arrays), dtype=np.int64)
+        else:
+            self.owners = np.asarray(owners, dtype=np.int64)
+        points = (np.concatenate(arrays) if arrays else
+                  np.empty((0, dims)))
+        del arrays
+
+        #Sort the points (or their grid points) so equal ones are in runs,
+        #and number the runs. The sort is stable, so each vertex keeps the
+        #coordinates of its first occurrence.
+        grid = points if tolerance is None else np.round(points / tolerance)
+        order = np.lexsort(grid.T[::-1])
+        ordered = grid[order]
+        del grid
+        new = np.ones(len(order), dtype=bool)
+        new[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+        del ordered
+        self.ids = np.empty(len(order), dtype=np.int64)
+        self.ids[order] = np.cumsum(new) - 1
+        self.vertices = points[order[new]]
+        if len(self.vertices) > MAX_VERTICES:
+            raise ValueError(f'{len(self.vertices)} distinct vertices; at '
+                             f'most {MAX_VERTICES} can be packed into keys')
+
+        #sides join consecutive points of the same boundary
+        ring_of = np.repeat(np.arange(len(lengths)), lengths)
+        starts, ends = self.ids[:-1], self.ids[1:]
+        real = (ring_of[:-1] == ring_of[1:]) & (starts != ends)
+        self.starts = starts[real]
+        self.ends = ends[real]
+        self.rings = ring_of[:-1][real]
+        self.keys = pack(self.starts, self.ends)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @staticmethod
+    def from_polygons(polygons, tolerance=None):
+        """Build the topology of the outer and inner boundaries of
+           `polygons`, each boundary owned by the index of its polygon.
+
+           :param polygons: a list of Polygons or CompactPolygons
+           :param tolerance: see `Topology.__init__`
+           """
+        boundaries, owners = [], []
+        for i, polygon in enumerate(polygons):
+            rings = ring_arrays(polygon)
+            boundaries.extend(rings)
+            owners.extend([i] * len(rings))
+        return Topology(boundaries, owners, tolerance)
+
+    def point(self, vertex):
+        """Return the point of vertex id `vertex` as a tuple of floats."""
+        return tuple(self.vertices[vertex].tolist())
+
+    def points(self):
+        """Return a list of the points of all the vertex ids, in order, as
+           tuples of floats."""
+        return list(map(tuple, self.vertices.tolist()))
+
+    def side_owners(self):
+        """Return the packed key and the owner of every side."""
+        return self.keys, self.owners[self.rings]